@@ -0,0 +1,98 @@
+""" models and data used by the benchmark scenarios, taken from the README
+"""
+import datetime
+import random
+
+import dico
+
+
+class BlogPost(dico.Document):
+    id = dico.IntegerField(required=True)
+    title = dico.StringField(required=True, max_length=200)
+    body = dico.StringField(required=True)
+    author = dico.EmailField()
+    created = dico.DateTimeField(default=datetime.datetime.utcnow)
+    tags = dico.ListField(dico.StringField(max_length=40))
+
+    owner_fields = ['id', 'title', 'body', 'author', 'created', 'tags']
+    public_fields = ['id', 'title', 'body', 'tags']
+
+
+class OAuthToken(dico.Document):
+    consumer_secret = dico.StringField(required=True, max_length=32)
+    active = dico.BooleanField(default=True)
+    token_id = dico.IntegerField(required=True)
+
+    owner_fields = ['consumer_secret', 'active', 'token_id']
+    public_fields = ['active', 'token_id']
+
+
+class User(dico.Document):
+    id = dico.IntegerField(required=True, aliases=['_id'])
+    firstname = dico.StringField(required=True, max_length=40)
+    lastname = dico.StringField(max_length=40)
+    email = dico.EmailField()
+    ip = dico.IPAddressField()
+    friends = dico.ListField(dico.IntegerField())
+    tokens = dico.ListField(dico.EmbeddedDocumentField(OAuthToken))
+
+    owner_fields = ['id', 'firstname', 'lastname', 'email', 'friends', 'tokens']
+    public_fields = ['id', 'firstname', 'full_name', 'tokens']
+
+    @property
+    def full_name(self):
+        return '%s %s' % (self.firstname, self.lastname)
+
+
+def deep_class(depth):
+    """ return a Document class embedding depth levels of documents
+        each level has a few scalar fields and a list of two children
+    """
+    child = None
+    for level in range(depth):
+        attrs = {
+            'name': dico.StringField(required=True),
+            'value': dico.IntegerField(),
+            'public_fields': ['name', 'value'],
+        }
+        if child is not None:
+            attrs['children'] = dico.ListField(dico.EmbeddedDocumentField(child))
+            attrs['public_fields'] = ['name', 'value', 'children']
+        child = dico.DocumentMetaClass('Level%d' % level, (dico.Document,), attrs)
+    return child
+
+
+def blog_post_dict(rnd, size):
+    return {
+        'id': rnd.randint(1, 10 ** 6),
+        'title': 'A post about %d things' % size,
+        'body': 'word ' * (size * 20),
+        'author': 'author%d@example.com' % rnd.randint(1, 1000),
+        'created': datetime.datetime(2012, 1, 1),
+        'tags': ['tag%d' % index for index in range(size)],
+    }
+
+
+def user_dict(rnd, size):
+    return {
+        '_id': rnd.randint(1, 10 ** 6),
+        'firstname': 'Sponge',
+        'lastname': 'Bob',
+        'email': 'sponge%d@bob.com' % rnd.randint(1, 1000),
+        'ip': '10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(0, 255)),
+        'friends': [rnd.randint(1, 10 ** 6) for index in range(size)],
+        'tokens': [{'consumer_secret': '%08x' % rnd.getrandbits(32),
+                    'active': bool(index % 2), 'token_id': index}
+                   for index in range(size)],
+    }
+
+
+def deep_dict(depth):
+    data = {'name': 'level%d' % depth, 'value': depth}
+    if depth > 1:
+        data['children'] = [deep_dict(depth - 1), deep_dict(depth - 1)]
+    return data
+
+
+def random_state(seed=42):
+    return random.Random(seed)
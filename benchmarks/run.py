@@ -0,0 +1,225 @@
+""" run the dico benchmark scenarios, save the results as JSON and compare
+    them to a baseline, exit with status 1 when a scenario got slower
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 0.2
+"""
+import gc
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import models
+
+SIZES = (1, 10, 100)
+DEPTHS = (2, 4, 6)
+
+
+class Scenario(object):
+    """ a measured operation, prepare(size) returns a factory building a
+        fresh input for each run, run(input) is the timed call
+    """
+    def __init__(self, name, sizes, prepare, run):
+        self.name = name
+        self.sizes = sizes
+        self.prepare = prepare
+        self.run = run
+
+
+def _user(size, modify=None, validate=True):
+    data = models.user_dict(models.random_state(), size)
+
+    def factory():
+        user = models.User(**data)
+        if validate:
+            user.validate()
+        if modify is not None:
+            modify(user)
+        return user
+    return factory
+
+
+def _blog_post(size):
+    data = models.blog_post_dict(models.random_state(), size)
+
+    def factory():
+        post = models.BlogPost(**data)
+        post.validate()
+        return post
+    return factory
+
+
+def _deep(depth, validate=True):
+    document_class = models.deep_class(depth)
+    data = models.deep_dict(depth)
+
+    def factory():
+        document = document_class(**data)
+        if validate:
+            document.validate()
+        return document
+    return factory
+
+
+def _user_dict(size):
+    data = models.user_dict(models.random_state(), size)
+    return lambda: data
+
+
+def _blog_post_dict(size):
+    data = models.blog_post_dict(models.random_state(), size)
+    return lambda: data
+
+
+def _deep_dict(depth):
+    document_class = models.deep_class(depth)
+    data = models.deep_dict(depth)
+    return lambda: (document_class, data)
+
+
+def _modify_user(user):
+    user.firstname = 'Patrick'
+    user.friends.append(1)
+    if user.tokens:
+        user.tokens[0].active = False
+
+
+def _scenarios():
+    scenarios = [
+        Scenario('construct.blog_post', SIZES, _blog_post_dict,
+                 lambda data: models.BlogPost(**data)),
+        Scenario('construct.user', SIZES, _user_dict,
+                 lambda data: models.User(**data)),
+        Scenario('construct.deep', DEPTHS, _deep_dict,
+                 lambda args: args[0](**args[1])),
+        Scenario('validate.user', SIZES, lambda size: _user(size, validate=False),
+                 lambda user: user.validate()),
+        Scenario('validate_partial.user', SIZES, lambda size: _user(size, validate=False),
+                 lambda user: user.validate_partial()),
+        Scenario('validate.deep', DEPTHS, lambda depth: _deep(depth, validate=False),
+                 lambda document: document.validate()),
+        Scenario('validate.modified_user', SIZES, lambda size: _user(size, _modify_user),
+                 lambda user: user.validate()),
+        Scenario('dict_for_save.blog_post', SIZES, _blog_post,
+                 lambda post: post.dict_for_save()),
+        Scenario('dict_for_modified_fields.user', SIZES, lambda size: _user(size, _modify_user),
+                 lambda user: user.dict_for_modified_fields()),
+        Scenario('dict_for_public.deep', DEPTHS, _deep,
+                 lambda document: document.dict_for_public()),
+        Scenario('list.append', SIZES, _user, lambda user: user.friends.append(1)),
+        Scenario('list.extend', SIZES, _user, lambda user: user.friends.extend([1, 2, 3])),
+        Scenario('list.setitem', SIZES, _user, lambda user: user.friends.__setitem__(0, 1)),
+        Scenario('list.pop', SIZES, _user, lambda user: user.friends.pop()),
+        Scenario('list.sort', SIZES, _user, lambda user: user.friends.sort()),
+        Scenario('list.append_token', SIZES, _user,
+                 lambda user: user.tokens.append(
+                     {'consumer_secret': 'abc', 'token_id': 1})),
+        Scenario('list.token_change', SIZES, _user,
+                 lambda user: setattr(user.tokens[-1], 'active', False)),
+        Scenario('clone.user', SIZES, _user, lambda user: user.clone()),
+        Scenario('clone.deep', DEPTHS, _deep, lambda document: document.clone()),
+    ]
+    for visibility in ('save', 'owner', 'public'):
+        method = 'dict_for_%s' % visibility
+        scenarios.append(Scenario('%s.user' % method, SIZES, _user,
+                                  lambda user, method=method: getattr(user, method)()))
+    return scenarios
+
+
+def measure(scenario, size, number, repeat):
+    """ return the best and median seconds per run over repeat rounds
+        of number runs, each on a fresh input
+    """
+    factory = scenario.prepare(size)
+    run = scenario.run
+    timings = []
+    for index in range(repeat):
+        inputs = [factory() for count in range(number)]
+        gc.collect()
+        start = time.time()
+        for value in inputs:
+            run(value)
+        timings.append((time.time() - start) / number)
+    timings.sort()
+    return {'best': timings[0], 'median': timings[len(timings) // 2],
+            'number': number, 'repeat': repeat}
+
+
+def run_all(number, repeat, pattern=None, quick=False, out=sys.stdout):
+    results = {}
+    for scenario in _scenarios():
+        if pattern is not None and pattern not in scenario.name:
+            continue
+        sizes = scenario.sizes[:1] if quick else scenario.sizes
+        for size in sizes:
+            key = '%s[%d]' % (scenario.name, size)
+            results[key] = measure(scenario, size, number, repeat)
+            out.write('%-40s %10.2f us\n' % (key, results[key]['best'] * 1e6))
+    return results
+
+
+def compare(baseline, results, tolerance, out=sys.stdout):
+    """ return the names of the scenarios slower than baseline by more
+        than tolerance (0.2 is 20%), scenarios missing from one side are skipped
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        before = baseline[key]['best']
+        after = results[key]['best']
+        ratio = after / before if before else 1.0
+        status = ''
+        if ratio > 1 + tolerance:
+            status = 'REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        out.write('%-40s %10.2f us %10.2f us %7.2fx %s\n' % (
+            key, before * 1e6, after * 1e6, ratio, status))
+    return regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', help='write the results to this JSON file')
+    parser.add_option('-b', '--baseline', help='compare with the results in this JSON file')
+    parser.add_option('-t', '--tolerance', type='float', default=0.2,
+                      help='allowed slow down before failing, default 0.2 for 20%')
+    parser.add_option('-n', '--number', type='int', default=200,
+                      help='runs per round, default 200')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='rounds per scenario and size, default 5')
+    parser.add_option('-k', '--filter', dest='pattern',
+                      help='only run scenarios whose name contains this')
+    parser.add_option('-q', '--quick', action='store_true', default=False,
+                      help='only run the smallest size of each scenario')
+    options, args = parser.parse_args(argv)
+
+    results = run_all(options.number, options.repeat, options.pattern, options.quick)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, output, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        sys.stdout.write('\n%-40s %13s %13s\n' % ('scenario', 'baseline', 'current'))
+        regressions = compare(baseline, results, options.tolerance)
+        if regressions:
+            sys.stdout.write('\n%d regression(s): %s\n' % (
+                len(regressions), ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,14 @@
 import re
+import copy
 import datetime
 import socket
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import islice
+from operator import attrgetter
+import json
+from json.encoder import encode_basestring_ascii
 
 URL_REGEX_COMPILED = re.compile(
     r'^https?://'
@@ -29,14 +37,46 @@ class ValidationException(Exception):
     pass
 
 
+# marker for missing values where None is a valid value
+_MISSING = object()
+
+# serialization plan entry kinds
+_PLAN_FIELD = 0
+_PLAN_PROPERTY = 1
+_PLAN_EMBEDDED = 2
+_PLAN_EMBEDDED_LIST = 3
+
+
+def _class_attribute(klass, name, default=None):
+    """ return the raw attribute from the class mro, functions stay unbound
+    """
+    for base in klass.__mro__:
+        if name in base.__dict__:
+            return base.__dict__[name]
+    return default
+
+
+def _defining_class(klass, name):
+    """ return the first class in klass mro defining name
+    """
+    for base in klass.__mro__:
+        if name in base.__dict__:
+            return base
+    return None
+
+
 class BaseField(object):
-    def __init__(self, default=None, required=False, choices=None, aliases=None):
+    def __init__(self, default=None, required=False, choices=None, aliases=None,
+                 db_name=None):
         """ the BaseField class for all Document's field
+            db_name is the key used in the database, accepted as input
+            and written by dict_for_save
         """
         self.default = default
         self.is_required = required
         self.choices = choices
         self.aliases = aliases
+        self.db_name = db_name
 
     def _register_document(self, document, field_name):
         self.field_name = field_name
@@ -44,15 +84,182 @@ class BaseField(object):
         if self.aliases is not None:
             for alias in self.aliases:
                 document._aliases.append((alias, field_name))
+        # the database name is read like an alias
+        if self.db_name is not None and self.db_name != field_name:
+            document._aliases.append((self.db_name, field_name))
+
+    def _type_check(self):
+        """ return a callable(value) checking the value for this field type
+            fields may override it to return a specialized closure
+        """
+        return self._validate
+
+    def _compile_type_check(self):
+        """ return _type_check() unless a subclass only overrides _validate
+        """
+        klass = type(self)
+        validate_owner = _defining_class(klass, '_validate')
+        check_owner = _defining_class(klass, '_type_check')
+        if validate_owner is not None and validate_owner is not check_owner \
+                and issubclass(validate_owner, check_owner):
+            return self._validate
+        return self._type_check()
+
+    def _export_converter(self):
+        """ return a callable(value) converting the stored value of this field
+            to the value exported by dict_for_* or None if they are the same
+        """
+        return None
+
+    def _json_converter(self):
+        """ return a callable(value) converting an exported value of this field
+            to a JSON native type or None if it is already one
+        """
+        return None
+
+    def _converters(self):
+        """ return (export, json) converters, json includes export
+        """
+        export = self._export_converter()
+        to_json = self._json_converter()
+        if export is None or to_json is None:
+            return export, to_json or export
+
+        def converter(value):
+            return to_json(export(value))
+        return export, converter
+
+    def _raw_type_check(self):
+        """ return a callable(value) checking a raw value as found in a dict
+            from the database, before any Document is built
+        """
+        return self._compile_type_check()
+
+    def _compiled_choices(self):
+        """ return a callable(value) testing value is in choices or None
+            choices are kept in a frozenset when they are hashable
+        """
+        choices = self.choices
+        if choices is None:
+            return None
+        try:
+            compiled = frozenset(choices)
+        except TypeError:
+            # unhashable choices, keep the original sequence
+            return choices.__contains__
 
-    def _changed(self, instance):
-        """ notify parent's document for changes """
-        instance._modified_fields.add(self.field_name)
-        instance._is_valid = False
+        def in_choices(value):
+            try:
+                return value in compiled
+            except TypeError:
+                # unhashable value, compare it with the original sequence
+                return value in choices
+        return in_choices
+
+    def _compile_check(self, raw=False):
+        """ return a callable(value) checking choices then field type
+            raw=True checks dicts and lists as received, see validate_dict
+        """
+        type_check = self._raw_type_check() if raw else self._compile_type_check()
+        in_choices = self._compiled_choices()
+        if in_choices is None:
+            return type_check
+
+        def check(value):
+            return in_choices(value) and type_check(value)
+        return check
+
+    def _changed(self, instance, path=None):
+        """ notify parent's document for changes
+            path is the dotted path changed inside this field, if any
+            or a tuple of parts when it goes through a list, see _resolve_path
+        """
+        field_name = self.field_name
+        clone_boxes = instance._clone_boxes
+        if clone_boxes is not None and field_name in clone_boxes:
+            # called before the change, clones sharing the value keep it as is
+            _unshare(instance, field_name)
+        instance._modified_fields.add(field_name)
+        # only this field, and the same field on each parent, is checked again
+        instance._valid_fields.discard(field_name)
+        if path is None:
+            path = field_name
+        elif path.__class__ is tuple:
+            path = (field_name,) + path
+        else:
+            path = '%s.%s' % (field_name, path)
+        instance._modified_paths.add(path)
+        session_ref = instance._session_ref
+        if session_ref is not None:
+            session = session_ref()
+            if session is not None:
+                session._changed(instance)
         # called recursively
-        if instance._parent:
+        parent_ref = instance._parent_ref
+        parent = parent_ref() if parent_ref is not None else None
+        if parent is not None:
             field = instance._parent_field
-            field._changed(instance._parent)
+            if isinstance(parent._fields[field.field_name], ListField):
+                # the index is looked up when the paths are read
+                if path.__class__ is tuple:
+                    path = (instance,) + path
+                else:
+                    path = (instance, path)
+            field._changed(parent, path)
+
+
+def _ref(obj):
+    """ return a weak reference to obj or None
+        parents are weakly referenced so document trees have no cycles
+        and are freed by reference counting
+    """
+    if obj is None:
+        return None
+    return weakref.ref(obj)
+
+
+def _deref(ref):
+    if ref is None:
+        return None
+    return ref()
+
+
+def _link(document, parent, field):
+    """ set the parent of an embedded document
+        the slots are set directly, skipping Document.__setattr__
+    """
+    object.__setattr__(document, '_parent_ref', _ref(parent))
+    object.__setattr__(document, '_parent_field', field)
+
+
+def _resolve_path(document, parts, indexes):
+    """ return the dotted path for parts recorded by BaseField._changed
+        a document in parts stands for its index in the list before it
+        and the path stops at the list when it is no longer there
+        indexes caches {id(list): {id(entry): index}} between calls
+    """
+    resolved = []
+    value = document
+    last = len(parts) - 1
+    for position, part in enumerate(parts):
+        if isinstance(part, Document):
+            if not isinstance(value, list):
+                break
+            positions = indexes.get(id(value))
+            if positions is None:
+                positions = indexes[id(value)] = dict(
+                    (id(entry), index) for index, entry in enumerate(value))
+            index = positions.get(id(part))
+            if index is None:
+                break
+            resolved.append(str(index))
+            value = part
+            continue
+        resolved.append(part)
+        if position < last:
+            for name in part.split('.'):
+                value = getattr(value, name) if isinstance(value, Document) else None
+    return '.'.join(resolved)
 
 
 class EmbeddedDocumentField(BaseField):
@@ -69,9 +276,10 @@ class EmbeddedDocumentField(BaseField):
             and set the parent
         """
         if isinstance(value, dict):
-            value = self.field_type(parent=instance, parent_field=self, **value)
+            # already linked by the constructor
+            return self.field_type(parent=instance, parent_field=self, **value)
         if isinstance(value, self.field_type):
-            value._parent_field = self
+            _link(value, instance, self)
         return value
 
     def _validate(self, value):
@@ -80,23 +288,43 @@ class EmbeddedDocumentField(BaseField):
 
         return value.validate()
 
+    def _raw_type_check(self):
+        field_type = self.field_type
+
+        def check(value):
+            if isinstance(value, dict):
+                return field_type.validate_dict(value)
+            return isinstance(value, field_type) and value.validate()
+        return check
+
 
 class NotifyParentList(list):
     """
         A minimal list subclass that will notify for modification to the parent
         for special case like parent.obj.append
+        it also keeps a compact log of its operations in _ops, see _log
     """
     def __init__(self, seq=(), parent=None, field=None):
-        self._parent = parent
+        self._parent_ref = _ref(parent)
         self._field = field
+        # [] nothing changed, [(op, values)] one mongo-like operation,
+        # None the list has to be rewritten
+        self._ops = []
         super(NotifyParentList, self).__init__(seq)
 
+    @property
+    def _parent(self):
+        return _deref(self._parent_ref)
+
+    @_parent.setter
+    def _parent(self, parent):
+        self._parent_ref = _ref(parent)
+
     def _tag_obj_for_parent_name(self, obj):
         """ check if the obj is a document and set his parent_name
         """
         if isinstance(obj, Document):
-            obj._parent = self._parent
-            obj._parent_field = self._field
+            _link(obj, self._parent, self._field)
             return
         try:
             iter(obj)
@@ -104,25 +332,64 @@ class NotifyParentList(list):
             return
         for entry in obj:
             if isinstance(entry, Document):
-                entry._parent = self._parent
-                entry._parent_field = self._field
+                _link(entry, self._parent, self._field)
         
     def __deepcopy__(self, memo):
         # we do not deep copy the parent nor fields
-        dup = NotifyParentList(parent=self._parent, field=self._field)
-        
-        dup = self[:]
+        # the parent is set again by a document copy, see _adopt
+        dup = NotifyParentList(field=self._field)
+        memo[id(self)] = dup
+        list.extend(dup, [copy.deepcopy(entry, memo) for entry in self])
+        dup._ops = copy.deepcopy(self._ops, memo)
         return dup
 
-    def _notify_parents(self):
-        self._field._changed(self._parent)
+    def __reduce__(self):
+        # parent and field are restored by the parent's __setstate__
+        return NotifyParentList, (list(self),), {'_ops': self._ops}
+
+    def _prepare_entry(self, obj):
+        """ prepare an added element like the ListField does on assignment
+        """
+        field = self._field
+        if field is None or not field.prepares_entries:
+            return obj
+        return field.subfield._prepare(self._parent, obj)
+
+    def _log(self, op, values):
+        """ add an operation to the log, 'push' and 'pull' are merged with
+            the previous operation of the same kind, a single 'pop' is kept
+            anything else marks the list to be rewritten
+        """
+        ops = self._ops
+        if ops is None:
+            return
+        if op is None:
+            self._ops = None
+        elif not ops:
+            ops.append((op, values))
+        elif ops[0][0] == op and op != 'pop':
+            ops[0][1].extend(values)
+        else:
+            self._ops = None
+
+    def _notify_parents(self, op=None, values=None):
+        self._log(op, values)
+        # _parent inlined, this runs on each list change
+        parent_ref = self._parent_ref
+        parent = parent_ref() if parent_ref is not None else None
+        if parent is not None:
+            self._field._changed(parent)
 
     def __add__(self, other):
-        self._tag_obj_for_parent_name(other)
-        self._notify_parents()
+        # a new list is returned, this one is not modified
         return super(NotifyParentList, self).__add__(other)
 
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
     def __setslice__(self, i, j, seq):
+        seq = [self._prepare_entry(entry) for entry in seq]
         self._tag_obj_for_parent_name(seq)
         self._notify_parents()
         return super(NotifyParentList, self).__setslice__(i, j, seq)
@@ -132,6 +399,10 @@ class NotifyParentList(list):
         return super(NotifyParentList, self).__delslice__(i, j)
 
     def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = [self._prepare_entry(entry) for entry in value]
+        else:
+            value = self._prepare_entry(value)
         self._tag_obj_for_parent_name(value)
         self._notify_parents()
         return super(NotifyParentList, self).__setitem__(key, value)
@@ -141,36 +412,68 @@ class NotifyParentList(list):
         return super(NotifyParentList, self).__delitem__(key)
 
     def append(self, p_object):
+        p_object = self._prepare_entry(p_object)
         self._tag_obj_for_parent_name(p_object)
-        self._notify_parents()
+        self._notify_parents('push', [p_object])
         return super(NotifyParentList, self).append(p_object)
 
     def remove(self, value):
-        self._notify_parents()
-        return super(NotifyParentList, self).remove(value)
+        # a pull removes every equal value, only safe if value is unique
+        # documents are compared by identity so they are never pulled
+        if not isinstance(value, Document) and self.count(value) == 1:
+            op = 'pull'
+        else:
+            op = None
+        try:
+            index = self.index(value)
+        except ValueError:
+            raise ValueError('list.remove(x): x not in list')
+        self._notify_parents(op, [value])
+        super(NotifyParentList, self).__delitem__(index)
 
     def insert(self, index, p_object):
+        p_object = self._prepare_entry(p_object)
         self._tag_obj_for_parent_name(p_object)
         self._notify_parents()
         return super(NotifyParentList, self).insert(index, p_object)
 
     def extend(self, iterable):
+        iterable = [self._prepare_entry(entry) for entry in iterable]
         self._tag_obj_for_parent_name(iterable)
-        self._notify_parents()
+        self._notify_parents('push', iterable[:])
         return super(NotifyParentList, self).extend(iterable)
 
     def pop(self, index=None):
-        if index is None:
-            if super(NotifyParentList, self).pop():
-                self._notify_parents()
+        length = len(self)
+        if not length:
+            raise IndexError('pop from empty list')
+        if index is not None and not -length <= index < length:
+            raise IndexError('pop index out of range')
+        # mongo $pop removes the last (1) or first (-1) element
+        if index is None or index in (-1, length - 1):
+            self._notify_parents('pop', 1)
+        elif index in (0, -length):
+            self._notify_parents('pop', -1)
         else:
-            if super(NotifyParentList, self).pop(index):
-                self._notify_parents()
+            self._notify_parents()
+        if index is None:
+            return super(NotifyParentList, self).pop()
+        return super(NotifyParentList, self).pop(index)
+
+    def sort(self, *args, **kwargs):
+        self._notify_parents()
+        return super(NotifyParentList, self).sort(*args, **kwargs)
+
+    def reverse(self):
+        self._notify_parents()
+        return super(NotifyParentList, self).reverse()
 
 
 class ListField(BaseField):
     def __init__(self, subfield, max_length=0, min_length=0, **kwargs):
         self.subfield = subfield
+        # looked up once for the entries added by NotifyParentList
+        self.prepares_entries = hasattr(subfield, '_prepare')
         self.max_length = max_length
         self.min_length = min_length
         if "default" not in kwargs:
@@ -199,6 +502,58 @@ class ListField(BaseField):
                 return False
         return True
 
+    def _type_check(self, raw=False, elements=True):
+        """ elements=False only checks the list itself and its length
+        """
+        max_length = self.max_length
+        min_length = self.min_length
+        # like _prepare, falsy entries are dropped when the subfield prepares
+        # them, dicts are kept as they become documents
+        drop_falsy = raw and self.prepares_entries
+        if not elements:
+            sub_check = None
+        elif raw:
+            sub_check = self.subfield._raw_type_check()
+        else:
+            sub_check = self.subfield._compile_type_check()
+
+        def check(value):
+            if not isinstance(value, list):
+                return False
+            if drop_falsy:
+                value = [entry for entry in value if entry or isinstance(entry, dict)]
+            if max_length != 0 and len(value) > max_length:
+                return False
+            if min_length != 0 and len(value) < min_length:
+                return False
+            if sub_check is not None:
+                for entry in value:
+                    if not sub_check(entry):
+                        return False
+            return True
+        return check
+
+    def _raw_type_check(self):
+        return self._type_check(raw=True)
+
+    def _export_converter(self):
+        convert = self.subfield._export_converter()
+        if convert is None:
+            return None
+
+        def converter(value):
+            return [convert(entry) for entry in value]
+        return converter
+
+    def _json_converter(self):
+        convert = self.subfield._json_converter()
+        if convert is None:
+            return None
+
+        def converter(value):
+            return [convert(entry) for entry in value]
+        return converter
+
     def _prepare(self, instance, value):
         """ we set the parent for each element
             and set a NotifyParentList in place of a list
@@ -208,7 +563,7 @@ class ListField(BaseField):
         except TypeError:
             pass
         else:
-            if hasattr(self.subfield, "_prepare"):
+            if self.prepares_entries:
                 obj_list = []
                 for obj in value:
                     obj = self.subfield._prepare(instance, obj)
@@ -226,12 +581,140 @@ class BooleanField(BaseField):
             return False
         return True
 
+    def _type_check(self):
+        def check(value):
+            return isinstance(value, bool)
+        return check
+
+
+class _LRUCache(object):
+    """ a bounded LRU mapping safe to share between threads, with hit,
+        miss and eviction counters, base of RegexCache and IdentityMap
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """ return the cached value, moved to the end, or _MISSING
+            and count a hit or a miss
+        """
+        with self._lock:
+            value = self._entries.pop(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = value
+            return value
+
+    def _store(self, key, value):
+        """ cache value, evicting the least recently used entry when full
+        """
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """ return a dict with hits, misses, evictions, size and max_size
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries),
+                    'max_size': self.max_size}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+class RegexCache(_LRUCache):
+    """ a bounded LRU cache of compiled_regex match results, safe to share
+        between threads, match() returns True or None like a failed match
+    """
+    def __init__(self, compiled_regex, max_size):
+        self.compiled_regex = compiled_regex
+        super(RegexCache, self).__init__(max_size)
+
+    def match(self, value):
+        result = self._lookup(value)
+        if result is _MISSING:
+            result = True if self.compiled_regex.match(value) is not None else None
+            self._store(value, result)
+        return result
+
+
+class IdentityMap(_LRUCache):
+    """ a bounded LRU cache of documents keyed by (class, value of field)
+        set it as the identity_map of a Document class, see Document.load
+        the id is read from data by field name or any of its aliases
+        cached documents are returned as they are, discard() stale ones
+    """
+    def __init__(self, field='id', max_size=1000):
+        self.field = field
+        self._key_names = {}
+        super(IdentityMap, self).__init__(max_size)
+
+    def _names(self, document_class):
+        """ return the keys holding the id in data for document_class
+        """
+        names = self._key_names.get(document_class)
+        if names is None:
+            names = (self.field,) + tuple(alias for alias, name in document_class._aliases
+                                          if name == self.field)
+            self._key_names[document_class] = names
+        return names
+
+    def load(self, document_class, data):
+        """ return the cached document_class instance for the id in data
+            or create it from data and cache it
+        """
+        for name in self._names(document_class):
+            value = data.get(name)
+            if value is not None:
+                break
+        else:
+            return document_class(**data)
+
+        key = (document_class, value)
+        document = self._lookup(key)
+        if document is _MISSING:
+            document = document_class(**data)
+            self._store(key, document)
+        return document
+
+    def get(self, document_class, value):
+        """ return the cached document or None, does not count as a hit
+        """
+        with self._lock:
+            return self._entries.get((document_class, value))
+
+    def discard(self, document_class, value):
+        with self._lock:
+            self._entries.pop((document_class, value), None)
+
 
 class StringField(BaseField):
-    def __init__(self, compiled_regex=None, max_length=None, min_length=None, **kwargs):
+    def __init__(self, compiled_regex=None, max_length=None, min_length=None,
+                 cache_size=0, **kwargs):
+        """ cache_size > 0 memoizes up to cache_size regex results, see RegexCache
+        """
         self.compiled_regex = compiled_regex
         self.max_length = max_length
         self.min_length = min_length
+        if compiled_regex is not None and cache_size > 0:
+            self.regex_cache = RegexCache(compiled_regex, cache_size)
+            self._match = self.regex_cache.match
+        else:
+            self.regex_cache = None
+            self._match = compiled_regex.match if compiled_regex is not None else None
         super(StringField, self).__init__(**kwargs)
 
     def _validate(self, value):
@@ -244,27 +727,128 @@ class StringField(BaseField):
         if self.min_length is not None and len(value) < self.min_length:
             return False
 
-        if self.compiled_regex is not None and self.compiled_regex.match(value) is None:
+        if self._match is not None and self._match(value) is None:
             if value == '' and not self.is_required:
                 return True
             return False
 
         return True
 
+    def _type_check(self):
+        max_length = self.max_length
+        min_length = self.min_length
+        match = self._match
+        empty_allowed = not self.is_required
+
+        def check(value):
+            if not isinstance(value, basestring):
+                return False
+            if max_length is not None and len(value) > max_length:
+                return False
+            if min_length is not None and len(value) < min_length:
+                return False
+            if match is not None and match(value) is None:
+                return empty_allowed and value == ''
+            return True
+        return check
+
+
+class _InvalidIPAddress(str):
+    """ marks a value that could not be packed by IPAddressField(packed=True)
+    """
+    __slots__ = ()
+
+
+class _PackedIPAddress(str):
+    """ marks the bytes returned by IPAddressField.pack
+    """
+    __slots__ = ()
+
+
+def _ip_family(value):
+    """ return the address family to try for an ip text, from its separator
+    """
+    return socket.AF_INET6 if ':' in value else socket.AF_INET
+
 
 class IPAddressField(StringField):
     """ validate ipv4 and ipv6
+        with packed=True valid addresses are stored as 4 or 16 bytes strings
+        (socket.inet_pton) and exported as text by the dict_for_* methods
+        values are set as text, or as returned by pack, eg b.ip = a.ip
     """
+    def __init__(self, packed=False, **kwargs):
+        self.packed = packed
+        if packed:
+            # only packed fields prepare their values
+            self._prepare = self._pack_prepare
+        super(IPAddressField, self).__init__(**kwargs)
+
     def _validate(self, value):
+        if self.packed:
+            return type(value) is _PackedIPAddress
+        return self._is_valid_text(value)
+
+    @staticmethod
+    def _is_valid_text(value):
+        if not isinstance(value, basestring):
+            return False
         try:
-            socket.inet_pton(socket.AF_INET, value)
-        except socket.error:
-            try:
-                socket.inet_pton(socket.AF_INET6, value)
-            except socket.error:
-                return False
+            socket.inet_pton(_ip_family(value), value)
+        except (socket.error, UnicodeError):
+            return False
         return True
 
+    def _type_check(self):
+        if self.packed:
+            def check(value):
+                return type(value) is _PackedIPAddress
+            return check
+        return self._is_valid_text
+
+    def _raw_type_check(self):
+        # raw values are always text
+        return self._is_valid_text
+
+    def validate_batch(self, values):
+        """ return a list of booleans, True for each valid ip text in values
+        """
+        is_valid_text = self._is_valid_text
+        return [is_valid_text(value) for value in values]
+
+    @staticmethod
+    def pack(value):
+        """ return the packed bytes of an ip text, raise ValueError if not valid
+        """
+        try:
+            return _PackedIPAddress(socket.inet_pton(_ip_family(value), value))
+        except (socket.error, TypeError, UnicodeError):
+            raise ValueError('%r is not a valid ip address' % (value,))
+
+    @staticmethod
+    def to_text(value):
+        """ return the text of a packed ip address
+        """
+        if type(value) is _PackedIPAddress:
+            return socket.inet_ntop(socket.AF_INET if len(value) == 4 else socket.AF_INET6,
+                                    value)
+        return value
+
+    def _pack_prepare(self, instance, value):
+        """ _prepare of packed fields, pack ip texts, invalid values are kept marked
+        """
+        if type(value) is _PackedIPAddress:
+            return value
+        try:
+            return self.pack(value)
+        except ValueError:
+            if type(value) is str:
+                return _InvalidIPAddress(value)
+            return value
+
+    def _export_converter(self):
+        return self.to_text if self.packed else None
+
 
 class URLField(StringField):
     def __init__(self, **kwargs):
@@ -282,6 +866,11 @@ class IntegerField(BaseField):
             return False
         return True
 
+    def _type_check(self):
+        def check(value):
+            return isinstance(value, (int, long))
+        return check
+
 
 class FloatField(BaseField):
     def _validate(self, value):
@@ -289,6 +878,11 @@ class FloatField(BaseField):
             return False
         return True
 
+    def _type_check(self):
+        def check(value):
+            return isinstance(value, (float, int))
+        return check
+
 
 class DateTimeField(BaseField):
     def _validate(self, value):
@@ -296,6 +890,228 @@ class DateTimeField(BaseField):
             return False
         return True
 
+    def _type_check(self):
+        def check(value):
+            return isinstance(value, datetime.datetime)
+        return check
+
+    def _json_converter(self):
+        return _datetime_to_json
+
+
+class _FrozenList(list):
+    """ a list shared between documents as a default value, never modified
+    """
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('shared default list can not be modified')
+
+    append = extend = insert = remove = pop = sort = reverse = _frozen
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _frozen
+    __iadd__ = __imul__ = _frozen
+
+
+def _shared_default(field):
+    """ return a read only value shared by all the documents for the default
+        of field, or _MISSING when each document needs its own prepared value
+    """
+    default = field.default
+    if default is None or callable(default):
+        return _MISSING
+    if isinstance(field, ListField) and isinstance(default, list) and \
+            (not default or not hasattr(field.subfield, '_prepare')):
+        return _FrozenList(default)
+    return _MISSING
+
+
+class _Shared(object):
+    """ an embedded document or list of a document lent to its clones
+        kept in their _raw_values, the first owners to access it get a copy
+        and the last one gets the value itself once it is detached: the
+        source document copied it before changing it, see _unshare
+    """
+    __slots__ = ('value', 'owners', 'attached', '__weakref__')
+
+    def __init__(self, value, owners, attached=False):
+        self.value = value
+        self.owners = owners
+        self.attached = attached
+
+    def __reduce__(self):
+        return _Shared, (self.value, self.owners)
+
+    def take(self):
+        self.owners -= 1
+        if self.owners > 0 or self.attached:
+            return _copy_subtree(self.value)
+        return self.value
+
+
+def _unshare(document, name):
+    """ give the clones sharing the value of name their own copy
+        before document changes it
+    """
+    clone_boxes = document._clone_boxes
+    box = clone_boxes.pop(name)()
+    if not clone_boxes:
+        document._clone_boxes = None
+    if box is not None and box.attached:
+        # a full copy, the change may be deeper in the subtree
+        value = copy.deepcopy(box.value)
+        _reset_tracking(value)
+        box.value = value
+        box.attached = False
+
+
+def _reset_tracking(value):
+    """ forget the changes recorded in an embedded document or list
+    """
+    if isinstance(value, Document):
+        value.commit()
+    elif isinstance(value, NotifyParentList):
+        value._ops = []
+        for entry in value:
+            _reset_tracking(entry)
+
+
+def _copy_subtree(value):
+    """ return a copy of an embedded document or list for clone()
+        embedded documents are cloned so their own subtrees stay shared
+    """
+    if isinstance(value, Document):
+        return value.clone()
+    if isinstance(value, NotifyParentList):
+        return NotifyParentList([_copy_subtree(entry) for entry in value],
+                                field=value._field)
+    return value
+
+
+def _adopt(document, field, value):
+    """ link an embedded document or list, and the documents it holds,
+        to its new parent document
+    """
+    if isinstance(value, Document):
+        _link(value, document, field)
+    elif isinstance(value, NotifyParentList):
+        value._parent = document
+        value._field = field
+        for entry in value:
+            _adopt(document, field.subfield, entry)
+
+
+def _compile_reader(klass, name, field):
+    """ return a callable(document) reading a field value for validation
+        and serialization, unlike getattr a default shared between
+        documents and a subtree shared by clone() are returned without
+        being copied and stored
+    """
+    shared = _shared_default(field)
+    if shared is _MISSING and not hasattr(field, '_prepare'):
+        return attrgetter(name)
+    get = getattr(klass, name).__get__
+
+    def read(document):
+        try:
+            return get(document)
+        except AttributeError:
+            raw_values = document._raw_values
+            if raw_values and name in raw_values:
+                value = raw_values[name]
+                if value.__class__ is _Shared:
+                    return value.value
+                return getattr(document, name)
+            if shared is _MISSING:
+                return getattr(document, name)
+            return shared
+    return read
+
+
+def _compile_validator(fields, field_checks, readers):
+    """ return a validator(document, stop_on_required) for this fields dict
+        checks are compiled once per class so validate() does no lookups
+    """
+    checks = tuple((name, field.is_required, field_checks[name], readers[name])
+                   for name, field in fields.items())
+    fields_count = len(checks)
+
+    def validator(document, stop_on_required=True):
+        valid_fields = document._valid_fields
+        if len(valid_fields) == fields_count:
+            return True
+        for name, is_required, check, read in checks:
+            if name in valid_fields:
+                continue
+            value = read(document)
+            if value is None:
+                if is_required:
+                    if stop_on_required:
+                        return False
+                    continue
+            elif not check(value):
+                return False
+            valid_fields.add(name)
+        return True
+    return validator
+
+
+def _compile_error_entries(fields, readers):
+    """ return a tuple of (name, read, is_required, in_choices, kind, check, element)
+        used by Document.validation_errors, element is the embedded document
+        class or the element check for lists
+    """
+    entries = []
+    for name, field in fields.items():
+        element = None
+        if isinstance(field, EmbeddedDocumentField):
+            kind = _PLAN_EMBEDDED
+            check = None
+            element = field.field_type
+        elif isinstance(field, ListField):
+            check = field._type_check(elements=False)
+            if isinstance(field.subfield, EmbeddedDocumentField):
+                kind = _PLAN_EMBEDDED_LIST
+                element = field.subfield.field_type
+            else:
+                kind = _PLAN_FIELD
+                element = field.subfield._compile_type_check()
+        else:
+            kind = _PLAN_FIELD
+            check = field._compile_type_check()
+        entries.append((name, readers[name], field.is_required,
+                        field._compiled_choices(), kind, check, element))
+    return tuple(entries)
+
+
+def _compile_raw_validator(fields, aliases):
+    """ return a validator(data, stop_on_required) for raw dicts
+        following the same rules as Document(**data).validate()
+    """
+    field_aliases = {}
+    for alias, name in aliases:
+        field_aliases.setdefault(name, []).append(alias)
+    entries = tuple((name, tuple(field_aliases.get(name, ())), field.is_required,
+                     field.default, field._compile_check(raw=True))
+                    for name, field in fields.items())
+
+    def validator(data, stop_on_required=True):
+        for name, name_aliases, is_required, default, check in entries:
+            value = data.get(name)
+            for alias in name_aliases:
+                if alias in data:
+                    if name in data:
+                        # Document(**data) would raise ValueError
+                        return False
+                    value = data[alias]
+            if value is None and default is not None:
+                value = default() if callable(default) else default
+            if value is None:
+                if stop_on_required and is_required:
+                    return False
+                continue
+            if not check(value):
+                return False
+        return True
+    return validator
+
 
 class DocumentMetaClass(type):
     def __new__(cls, name, bases, attrs):
@@ -327,43 +1143,114 @@ class DocumentMetaClass(type):
                     base_fields.update(klass._fields)
                     klass._fields = base_fields
                     klass._aliases += base._aliases
+
+            klass._checks = dict((name, field._compile_check())
+                                 for name, field in klass._fields.items())
+            klass._readers = dict((name, _compile_reader(klass, name, field))
+                                  for name, field in klass._fields.items())
+            klass._validator = _compile_validator(klass._fields, klass._checks,
+                                                  klass._readers)
+            # constructor tables: accepted input key -> field name,
+            # keys conflicting with an alias, fields needing _prepare
+            klass._input_names = dict((name, name) for name in klass._fields)
+            klass._alias_conflicts = {}
+            for alias, name in klass._aliases:
+                klass._input_names[alias] = name
+                klass._alias_conflicts[alias] = tuple([name] +
+                    [other for other, other_name in klass._aliases
+                     if other_name == name and other != alias])
+            klass._db_names = dict((name, field.db_name or name)
+                                   for name, field in klass._fields.items())
+            klass._prepared_fields = frozenset(name for name, field in klass._fields.items()
+                                               if hasattr(field, '_prepare'))
+            klass._error_entries = _compile_error_entries(klass._fields, klass._readers)
+            klass._raw_validator = staticmethod(
+                _compile_raw_validator(klass._fields, klass._aliases))
+            klass._plans = {}
         return klass
 
 
 class Document(object):
 
     __metaclass__ = DocumentMetaClass
-    __slots__ = ('_modified_fields', '_is_valid', '_parent', '_parent_field')
+    __slots__ = ('_modified_fields', '_modified_paths', '_valid_fields',
+                 '_parent_ref', '_parent_field', '_raw_values', '_session_ref',
+                 '_clone_boxes', '__weakref__')
 
     _meta = True
 
+    # when True embedded documents and lists are kept as received
+    # and only prepared on first access, see __getattr__
+    lazy_hydration = False
+
+    # an IdentityMap caching the instances returned by load and iter_from
+    identity_map = None
+
     def __init__(self, parent=None, parent_field=None, **values):
-        self._modified_fields = set()
-        # optimization to avoid double validate() if nothing has changed
-        self._is_valid = False
-        self._parent = parent
-        self._parent_field = parent_field
-
-        # TODO: this check should be done during __new__
-        for alias, key in self._aliases:
-            if alias in values:
-                if key in values:
-                    raise ValueError("The field %s overrides this alias %s" %
-                        (key, alias))
-                values[key] = values[alias]
-                del values[alias]
-
-        for key, field in self._fields.items():
-            value = values.get(key, None)
+        # internal slots are set directly, not through __setattr__
+        setter = object.__setattr__
+        setter(self, '_modified_fields', set())
+        setter(self, '_modified_paths', set())
+        # names of the fields checked valid since their last change
+        # so validate() only checks again modified fields
+        setter(self, '_valid_fields', set())
+        setter(self, '_parent_ref', weakref.ref(parent) if parent is not None else None)
+        setter(self, '_parent_field', parent_field)
+        setter(self, '_raw_values', None)
+        # a weak reference to the unit of work tracking this document
+        setter(self, '_session_ref', None)
+        # {name: weak reference to the _Shared box} lent to clones
+        setter(self, '_clone_boxes', None)
+
+        input_names = self._input_names
+        prepared_fields = self._prepared_fields
+        lazy = self.lazy_hydration
+        for key, value in values.iteritems():
+            name = input_names.get(key)
+            if name is None:
+                continue
+            if key != name:
+                for other in self._alias_conflicts[key]:
+                    if other in values:
+                        raise ValueError("The field %s overrides this alias %s" %
+                            (other, key))
 
             if value is not None:
-                if hasattr(field, "_prepare"):
-                    value = field._prepare(self, value)
-                object.__setattr__(self, key, value)
+                if name in prepared_fields:
+                    if lazy:
+                        if self._raw_values is None:
+                            setter(self, '_raw_values', {})
+                        self._raw_values[name] = value
+                        continue
+                    value = self._fields[name]._prepare(self, value)
+                setter(self, name, value)
+
+    @property
+    def _parent(self):
+        """ the parent document, held by a weak reference
+        """
+        return _deref(self._parent_ref)
+
+    @_parent.setter
+    def _parent(self, parent):
+        self._parent_ref = _ref(parent)
 
     def __getattr__(self, name):
         field = self._fields.get(name, None)
         if field:
+            raw_values = self._raw_values
+            if raw_values and name in raw_values:
+                value = raw_values.pop(name)
+                if value.__class__ is _Shared:
+                    # first access to a subtree shared by clone()
+                    value = value.take()
+                    _reset_tracking(value)
+                    _adopt(self, field, value)
+                else:
+                    # lazy hydration of a value kept raw by __init__
+                    value = field._prepare(self, value)
+                object.__setattr__(self, name, value)
+                return value
             value = field.default
             if callable(value):
                 value = value()
@@ -377,41 +1264,125 @@ class Document(object):
     def __setattr__(self, name, value):
         field = self._fields.get(name, None)
         if field is not None:
+            if self._raw_values:
+                raw = self._raw_values.pop(name, None)
+                if raw.__class__ is _Shared:
+                    raw.owners -= 1
             if hasattr(field, "_prepare"):
                 value = field._prepare(self, value)
+                if isinstance(value, NotifyParentList):
+                    # a new list is always written as a whole
+                    value._ops = None
             field._changed(self)
         return object.__setattr__(self, name, value)
 
+    def __getstate__(self):
+        """ return a compact state, the values set on the document
+            and its change tracking, without the parent
+        """
+        klass = self.__class__
+        values = {}
+        for name in self._fields:
+            try:
+                values[name] = getattr(klass, name).__get__(self)
+            except AttributeError:
+                pass
+        return (values, self._raw_values, self._modified_fields,
+                self._modified_paths, self._valid_fields)
+
+    def __setstate__(self, state):
+        values, raw_values, modified_fields, modified_paths, valid_fields = state
+        object.__setattr__(self, '_modified_fields', modified_fields)
+        object.__setattr__(self, '_modified_paths', modified_paths)
+        object.__setattr__(self, '_valid_fields', valid_fields)
+        object.__setattr__(self, '_parent_ref', None)
+        object.__setattr__(self, '_parent_field', None)
+        object.__setattr__(self, '_raw_values', raw_values)
+        object.__setattr__(self, '_session_ref', None)
+        object.__setattr__(self, '_clone_boxes', None)
+        fields = self._fields
+        for name, value in values.iteritems():
+            field = fields[name]
+            object.__setattr__(self, name, value)
+            # link embedded documents and lists back to this document
+            _adopt(self, field, value)
+
+    def clone(self):
+        """ return a copy of this document with no modified fields
+            embedded documents and lists are lent to the copy until it
+            accesses them, then it gets its own copy, a change of this
+            document copies them first for the clones, see _unshare
+        """
+        klass = self.__class__
+        clone = klass.__new__(klass)
+        object.__setattr__(clone, '_modified_fields', set())
+        object.__setattr__(clone, '_modified_paths', set())
+        object.__setattr__(clone, '_valid_fields', set(self._valid_fields))
+        object.__setattr__(clone, '_parent_ref', None)
+        object.__setattr__(clone, '_parent_field', None)
+        object.__setattr__(clone, '_session_ref', None)
+        object.__setattr__(clone, '_clone_boxes', None)
+
+        raw_values = self._raw_values
+        clone_raw_values = {}
+        if raw_values:
+            for value in raw_values.itervalues():
+                if value.__class__ is _Shared:
+                    value.owners += 1
+            clone_raw_values.update(raw_values)
+        clone_boxes = self._clone_boxes
+        for name in self._fields:
+            slot = getattr(klass, name)
+            try:
+                value = slot.__get__(self)
+            except AttributeError:
+                continue
+            if not isinstance(value, (Document, NotifyParentList)):
+                object.__setattr__(clone, name, value)
+                continue
+            # one box for all the clones until this document changes value
+            box = clone_boxes[name]() if clone_boxes and name in clone_boxes else None
+            if box is not None and box.attached and box.value is value:
+                box.owners += 1
+            else:
+                box = _Shared(value, 1, attached=True)
+                if clone_boxes is None:
+                    clone_boxes = self._clone_boxes = {}
+                clone_boxes[name] = weakref.ref(box)
+            clone_raw_values[name] = box
+        object.__setattr__(clone, '_raw_values', clone_raw_values or None)
+        return clone
+
     def _validate_fields(self, fields_list, stop_on_required=True):
         """ take a list of fields name and validate them
             return True if all fields in fields_list required are valid and set
             return True if fields in fields_list are valid
             and set if stop_on_required=False
         """
+        fields = self._fields
+        checks = self._checks
+        valid_fields = self._valid_fields
         for field_name in fields_list:
+            if field_name in valid_fields:
+                continue
+            field = fields.get(field_name)
             # if field name is not in the field list but a property
-            if field_name not in self._fields.keys():
-
+            if field is None:
                 if hasattr(self, field_name):
                     continue
                 else:
                     raise KeyError
 
-            field = self._fields[field_name]
-            value = getattr(self, field_name)
+            value = self._readers[field_name](self)
 
             if value is None:
-                if stop_on_required and field.is_required:
-                    return False
-                continue
-
-            # validate possible choices first
-            if field.choices is not None:
-                if value not in field.choices:
-                    return False
-
-            if not field._validate(value):
+                if field.is_required:
+                    if stop_on_required:
+                        return False
+                    continue
+            elif not checks[field_name](value):
                 return False
+            valid_fields.add(field_name)
 
         return True
 
@@ -420,16 +1391,68 @@ class Document(object):
             return True if fields are valid and set if required=False
             see validate_partial
         """
-        if stop_on_required and self._is_valid:
-            return True
-
-        is_valid = self._validate_fields(self._fields.keys(),
-            stop_on_required=stop_on_required)
-
-        if stop_on_required and is_valid:
-            self._is_valid = True
-
-        return is_valid
+        return self._validator(stop_on_required)
+
+    def validation_errors(self, stop_on_required=True, max_errors=100, fail_fast=False):
+        """ return a list of (path, reason) for invalid fields in a single pass
+            reason is 'required', 'choices' or 'invalid'
+            paths go through embedded documents and list indexes, eg 'tokens.2.secret'
+            collection stops after max_errors errors (None for no limit)
+            or after the first one with fail_fast
+        """
+        errors = []
+        if fail_fast:
+            max_errors = 1
+        self._collect_errors(errors, '', stop_on_required, max_errors)
+        return errors
+
+    def _collect_errors(self, errors, prefix, stop_on_required, max_errors):
+        """ append (path, reason) to errors for each invalid field
+            return True when max_errors is reached
+            like validate_partial, stop_on_required only applies to this
+            document, embedded ones are always checked for required fields
+        """
+        valid_fields = self._valid_fields
+        for name, read, is_required, in_choices, kind, check, element in self._error_entries:
+            if name in valid_fields:
+                continue
+            path = prefix + name
+            count = len(errors)
+            value = read(self)
+            if value is None:
+                if is_required:
+                    if not stop_on_required:
+                        continue
+                    errors.append((path, 'required'))
+            elif in_choices is not None and not in_choices(value):
+                errors.append((path, 'choices'))
+            elif kind is _PLAN_EMBEDDED:
+                if not isinstance(value, element):
+                    errors.append((path, 'invalid'))
+                elif value._collect_errors(errors, path + '.', True, max_errors):
+                    return True
+            elif not check(value):
+                errors.append((path, 'invalid'))
+            elif element is not None:
+                # list elements
+                for index, entry in enumerate(value):
+                    entry_path = '%s.%d' % (path, index)
+                    if kind is _PLAN_EMBEDDED_LIST:
+                        if not isinstance(entry, element):
+                            errors.append((entry_path, 'invalid'))
+                        elif entry._collect_errors(errors, entry_path + '.',
+                                                   True, max_errors):
+                            return True
+                    elif not element(entry):
+                        errors.append((entry_path, 'invalid'))
+                    if max_errors is not None and len(errors) >= max_errors:
+                        return True
+
+            if len(errors) == count:
+                valid_fields.add(name)
+            elif max_errors is not None and len(errors) >= max_errors:
+                return True
+        return False
 
     def validate_partial(self):
         """ validate only the format of each field regardless of stop_on_required option
@@ -437,6 +1460,64 @@ class Document(object):
         """
         return self.validate(stop_on_required=False)
 
+    @classmethod
+    def validate_dict(cls, data, stop_on_required=True):
+        """ validate a raw dict (from the DB or JSON) against this class
+            without instantiating it, aliases and defaults are applied
+            embedded documents are validated from their sub dicts
+        """
+        return cls._raw_validator(data, stop_on_required)
+
+    @classmethod
+    def validate_many(cls, dicts, stop_on_required=True):
+        """ return a generator of validate_dict results for each dict
+        """
+        validator = cls._raw_validator
+        for data in dicts:
+            yield validator(data, stop_on_required)
+
+    @classmethod
+    def load(cls, data):
+        """ return a document for data, the one cached for its id
+            when the class has an identity_map
+        """
+        identity_map = cls.identity_map
+        if identity_map is None:
+            return cls(**data)
+        return identity_map.load(cls, data)
+
+    @classmethod
+    def iter_from(cls, dicts, validate=False, visibility=None, chunk_size=100,
+                  on_error=None):
+        """ return a generator of documents created from an iterable of dicts
+            read chunk_size dicts at a time, so memory does not grow with the source
+            validate=True or 'partial' checks each dict before creating the document
+            visibility='save', 'owner' or 'public' yields dict_for_%s() instead
+            invalid records are skipped and passed to on_error(data, exception)
+        """
+        if validate:
+            stop_on_required = validate != 'partial'
+            validator = cls._raw_validator
+        method_name = 'dict_for_%s' % visibility if visibility else None
+
+        iterator = iter(dicts)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            for data in chunk:
+                try:
+                    if validate and not validator(data, stop_on_required):
+                        raise ValidationException()
+                    document = cls.load(data)
+                    if method_name is not None:
+                        document = getattr(document, method_name)()
+                except (ValidationException, ValueError, KeyError) as exception:
+                    if on_error is not None:
+                        on_error(data, exception)
+                    continue
+                yield document
+
     def _apply_filters(self, filters_list_or_callable, to_filter):
         """ apply all filters function (one arg the dict to filter)
         """
@@ -454,49 +1535,145 @@ class Document(object):
 
         return to_filter
 
-    def _call_for_visibility_on_child(self, data_dict, fields_list,
-                                      visibility, json_compliant=False):
-        """ this will call dict_for_%s() visibility on EmbeddedDocument
-            and ListField and return a dict
-            containing data_dict with key replaced by the result (in place)
-        """
-        for field in fields_list:
-            if isinstance(self._fields[field], EmbeddedDocumentField):
-                if field in data_dict and data_dict[field] is not None:
-                    call_method = getattr(data_dict[field], 'dict_for_%s' % visibility)
-                    data_dict[field] = call_method(json_compliant)
-
-            if isinstance(self._fields[field], ListField):
-                if isinstance(self._fields[field].subfield, EmbeddedDocumentField):
-                    current_field = []
-                    for doc in data_dict[field]:
-                        call_method = getattr(doc, 'dict_for_%s' % visibility)
-                        current_field.append(call_method(json_compliant))
-                    data_dict[field] = current_field
-        return data_dict
-
-    def dict_for_save(self, json_compliant=False):
-        """ return a copy dict with field_name:value
-            raise ValidationError if not valid
+    @classmethod
+    def _plan_entries(cls, visibility, fields_list):
+        """ return a tuple of (key, reader, kind, child method name,
+            export converter, json converter) for fields_list
+            raise KeyError for a name that is neither a field nor an attribute
         """
-        # TODO: put back a cache here if validate has been called earlier
-        if not self.validate():
+        method_name = 'dict_for_%s' % visibility
+        entries = []
+        for key in fields_list:
+            field = cls._fields.get(key)
+            if field is None:
+                if not hasattr(cls, key):
+                    raise KeyError(key)
+                kind = _PLAN_PROPERTY
+                read = attrgetter(key)
+            elif isinstance(field, EmbeddedDocumentField):
+                kind = _PLAN_EMBEDDED
+            elif isinstance(field, ListField) and \
+                    isinstance(field.subfield, EmbeddedDocumentField):
+                kind = _PLAN_EMBEDDED_LIST
+            else:
+                kind = _PLAN_FIELD
+            if field is not None:
+                read = cls._readers[key]
+            if kind is _PLAN_FIELD:
+                export, to_json = field._converters()
+            else:
+                export = to_json = None
+            if visibility == 'save' and field is not None:
+                key = cls._db_names[key]
+            entries.append((key, read, kind, method_name, export, to_json))
+        return tuple(entries)
+
+    @classmethod
+    def _plan(cls, visibility):
+        """ return the cached (fields_list, entries, filters, field_names)
+            serialization plan for visibility, built on first use
+            field_names are the names of fields_list that are not properties
+        """
+        plan = cls._plans.get(visibility)
+        if plan is None:
+            if visibility == 'save':
+                fields_list = tuple(cls._fields.keys())
+            else:
+                fields_list = tuple(getattr(cls, '%s_fields' % visibility, []))
+            entries = cls._plan_entries(visibility, fields_list)
+            filters = _class_attribute(cls, 'pre_%s_filter' % visibility)
+            if filters is None:
+                filters = ()
+            elif callable(filters):
+                filters = (filters,)
+            else:
+                filters = tuple(filter for filter in filters if callable(filter))
+            field_names = tuple(name for name in fields_list if name in cls._fields)
+            plan = (fields_list, entries, filters, field_names)
+            cls._plans[visibility] = plan
+        return plan
+
+    def _run_plan(self, entries, json_compliant=False):
+        """ return a dict built from plan entries
+        """
+        result = {}
+        for key, read, kind, method_name, export, to_json in entries:
+            value = read(self)
+            if kind is _PLAN_PROPERTY:
+                result[key] = value
+                continue
+            if value is None:
+                continue
+            if kind is _PLAN_EMBEDDED:
+                value = getattr(value, method_name)(json_compliant)
+            elif kind is _PLAN_EMBEDDED_LIST:
+                value = [getattr(doc, method_name)(json_compliant) for doc in value]
+            else:
+                if value.__class__ is _FrozenList:
+                    value = list(value)
+                converter = to_json if json_compliant else export
+                if converter is not None:
+                    value = converter(value)
+            result[key] = value
+        return result
+
+    def _valid_plan(self, visibility):
+        """ return the plan for visibility
+            raise ValidationError if not valid for this visibility
+        """
+        plan = self._plan(visibility)
+        if visibility == 'save':
+            is_valid = self.validate()
+        else:
+            # properties are only read by _run_plan
+            is_valid = self._validate_fields(plan[3], stop_on_required=True)
+        if not is_valid:
             raise ValidationException()
+        return plan
 
-        save_dict = {}
-        for key in self._fields.keys():
-            value = getattr(self, key)
-            if value is not None:
-                save_dict[key] = value
+    def _write_json(self, write, visibility):
+        """ write the JSON of dict_for_%s(json_compliant=True) % visibility
+            field by field with write, without building the dict
+            when the visibility has filters the filtered dict is written
+        """
+        fields_list, entries, filters, field_names = self._valid_plan(visibility)
+        if filters:
+            result = self._apply_filters(filters, self._run_plan(entries, True))
+            _write_json_value(result, write, visibility)
+            return
 
-        # we have to call dict_for_save() on embedded document
-        save_dict = self._call_for_visibility_on_child(save_dict,
-            self._fields, 'save', json_compliant)
-        
-        has_filter = getattr(self, 'pre_save_filter', None)
+        write('{')
+        separator = ''
+        for key, read, kind, method_name, export, converter in entries:
+            value = read(self)
+            if value is None and kind is not _PLAN_PROPERTY:
+                continue
+            write(separator)
+            separator = ','
+            write(encode_basestring_ascii(key))
+            write(':')
+            if kind is _PLAN_EMBEDDED:
+                value._write_json(write, visibility)
+            elif kind is _PLAN_EMBEDDED_LIST:
+                write('[')
+                for index, doc in enumerate(value):
+                    if index:
+                        write(',')
+                    doc._write_json(write, visibility)
+                write(']')
+            else:
+                if converter is not None:
+                    value = converter(value)
+                _write_json_value(value, write, visibility)
+        write('}')
 
-        return save_dict if has_filter is None else \
-            self._apply_filters(self.pre_save_filter, save_dict)
+    def dict_for_save(self, json_compliant=False):
+        """ return a copy dict with field_name:value
+            raise ValidationError if not valid
+        """
+        fields_list, entries, filters, field_names = self._valid_plan('save')
+        save_dict = self._run_plan(entries, json_compliant)
+        return self._apply_filters(filters, save_dict) if filters else save_dict
 
     def dict_for_public(self, json_compliant=False):
         """ return a copy dict with keys specified in public_fields
@@ -504,11 +1681,7 @@ class Document(object):
             or return empty dict
             raise ValidationError if not valid
         """
-        public_fields = getattr(self, 'public_fields', [])
-        public_dict = self._dict_for_fields('public', public_fields, json_compliant)
-        has_filter = getattr(self, 'pre_public_filter', None)
-        return public_dict if has_filter is None else\
-            self._apply_filters(self.pre_public_filter, public_dict)
+        return self._dict_for_visibility('public', json_compliant)
 
     def dict_for_owner(self, json_compliant=False):
         """ return a copy dict with keys specified in owner_fields
@@ -516,11 +1689,14 @@ class Document(object):
             or return empty dict
             raise ValidationError if not valid
         """
-        owner_fields = getattr(self, 'owner_fields', [])
-        owner_dict = self._dict_for_fields('owner', owner_fields, json_compliant)
-        has_filter = getattr(self, 'pre_owner_filter', None)
-        return owner_dict if has_filter is None else\
-            self._apply_filters(self.pre_owner_filter, owner_dict)
+        return self._dict_for_visibility('owner', json_compliant)
+
+    def _dict_for_visibility(self, visibility, json_compliant=False):
+        """ run the cached plan for visibility then its pre filters
+        """
+        fields_list, entries, filters, field_names = self._valid_plan(visibility)
+        result = self._run_plan(entries, json_compliant)
+        return self._apply_filters(filters, result) if filters else result
 
     def _dict_for_fields(self, visibility, fields_list=None, json_compliant=False):
         """ return a dict with keys specified in fields_list from _data
@@ -531,30 +1707,48 @@ class Document(object):
         """
         if fields_list is None:
             return {}
-        if not self._is_valid:
-            if not self._validate_fields(fields_list, stop_on_required=True):
-                raise ValidationException()
-
-        # find all the keys in fields_list that are fields
-        # and form a dict with the value in _data
-        field_dict = {good_key: getattr(self, good_key) for good_key in fields_list
-            if good_key in self._fields.keys() and getattr(self, good_key) is not None}
-        # call sub dict_for_method
-        subok_dict = self._call_for_visibility_on_child(field_dict, field_dict.keys(),
-            visibility=visibility, json_compliant=json_compliant)
-
-        # find all the keys in public_fields that are NOT fields
-        # return a dict with getattr on the obj
-        property_dict =  {key_not_real_field: getattr(self, key_not_real_field)
-                            for key_not_real_field in fields_list
-                            if key_not_real_field not in self._fields.keys()}
-        return dict(subok_dict.items() + property_dict.items())
+        if not self._validate_fields(fields_list, stop_on_required=True):
+            raise ValidationException()
+
+        return self._run_plan(self._plan_entries(visibility, fields_list),
+                              json_compliant)
 
     def modified_fields(self):
         """ return a set of fields modified via setters
         """
         return self._modified_fields
 
+    def modified_paths(self):
+        """ return a set of dotted paths modified via setters
+            going through embedded documents and list indexes, eg 'tokens.2.active'
+        """
+        paths = self._modified_paths
+        if not any(path.__class__ is tuple for path in paths):
+            return paths
+        indexes = {}
+        return set(_resolve_path(self, path, indexes) if path.__class__ is tuple else path
+                   for path in paths)
+
+    def commit(self):
+        """ reset modified fields and paths, once changes are saved
+            embedded documents and list operation logs are reset too
+        """
+        self._modified_fields.clear()
+        self._modified_paths.clear()
+        klass = self.__class__
+        for name in self._fields:
+            try:
+                value = getattr(klass, name).__get__(self)
+            except AttributeError:
+                continue
+            if isinstance(value, Document):
+                value.commit()
+            elif isinstance(value, NotifyParentList):
+                value._ops = []
+                for entry in value:
+                    if isinstance(entry, Document):
+                        entry.commit()
+
     def dict_for_modified_fields(self, validate=True):
         """ return a dict of fields modified via setters as key with value
             will raise ValidationError if partial modified data not valid
@@ -563,7 +1757,86 @@ class Document(object):
         if validate and not self.validate_partial():
             raise ValidationException()
 
-        return {good_key: getattr(self, good_key) for good_key in self._modified_fields}
+        modified_dict = {}
+        for good_key in self._modified_fields:
+            value = getattr(self, good_key)
+            export = self._fields[good_key]._export_converter()
+            if export is not None and value is not None:
+                value = export(value)
+            modified_dict[self._db_names[good_key]] = value
+        return modified_dict
+
+
+def _datetime_to_json(value):
+    return value.isoformat()
+
+
+def _write_json_value(value, write, visibility):
+    """ write value as JSON, documents are written for visibility
+    """
+    if value is None:
+        write('null')
+    elif value is True:
+        write('true')
+    elif value is False:
+        write('false')
+    elif isinstance(value, basestring):
+        write(encode_basestring_ascii(value))
+    elif isinstance(value, (int, long)):
+        write(str(value))
+    elif isinstance(value, float):
+        write(json.dumps(value))
+    elif isinstance(value, Document):
+        value._write_json(write, visibility)
+    elif isinstance(value, (list, tuple)):
+        write('[')
+        for index, entry in enumerate(value):
+            if index:
+                write(',')
+            _write_json_value(entry, write, visibility)
+        write(']')
+    elif isinstance(value, dict):
+        write('{')
+        separator = ''
+        for key, entry in value.iteritems():
+            write(separator)
+            separator = ','
+            write(encode_basestring_ascii(key if isinstance(key, basestring) else str(key)))
+            write(':')
+            _write_json_value(entry, write, visibility)
+        write('}')
+    elif isinstance(value, datetime.datetime):
+        write(encode_basestring_ascii(value.isoformat()))
+    else:
+        write(json.dumps(value))
+
+
+def dump(documents, fp, visibility='public'):
+    """ write a document or a list of documents as JSON to fp
+            following dict_for_%s(json_compliant=True) % visibility
+        raise ValidationError if not valid
+    """
+    _write_json_value(documents, fp.write, visibility)
+
+
+def dumps(documents, visibility='public'):
+    """ return a document or a list of documents as a JSON string
+            following dict_for_%s(json_compliant=True) % visibility
+        raise ValidationError if not valid
+    """
+    chunks = []
+    _write_json_value(documents, chunks.append, visibility)
+    return ''.join(chunks)
+
+
+def depends_on(*names):
+    """ declare the fields, or dotted paths, a property reads
+        put it under @property, see dico.mongo.projection
+    """
+    def decorator(function):
+        function.depends_on = names
+        return function
+    return decorator
 
 
 # Filters
@@ -0,0 +1,194 @@
+try:
+    import numpy
+except ImportError:
+    raise ImportError(
+        'Using the DocumentBatch requires numpy. '
+    )
+
+import datetime
+
+from . import BooleanField, DateTimeField, FloatField, IntegerField
+
+
+# field class -> (numpy dtype, python type check, fill value)
+# checks are on exact types, the array gives back values of that type only
+_COLUMN_TYPES = (
+    (BooleanField, numpy.bool_, lambda value: type(value) is bool, False),
+    (IntegerField, numpy.int64, lambda value: type(value) is int, 0),
+    (FloatField, numpy.float64, lambda value: type(value) is float, 0.0),
+    (DateTimeField, 'datetime64[us]',
+     lambda value: type(value) is datetime.datetime and value.tzinfo is None, None),
+)
+
+
+def _column_type(field):
+    """ return (dtype, check, fill) for fields stored as typed arrays or None
+        only exact builtin fields are typed, subclasses may validate differently
+    """
+    for field_class, dtype, check, fill in _COLUMN_TYPES:
+        if type(field) is field_class:
+            return dtype, check, fill
+    return None
+
+
+class Column(object):
+    """ values of one field for all the rows of a DocumentBatch
+
+        typed columns keep values in a numpy array, with a present mask for
+        None and an extras dict {row: value} for values the array can not
+        give back unchanged (other types like long, int in a float column,
+        aware datetimes)
+        other columns keep a list of python objects
+    """
+    def __init__(self, field, values):
+        self.field = field
+        self.column_type = _column_type(field)
+        length = len(values)
+        self.present = numpy.fromiter((value is not None for value in values),
+                                      dtype=numpy.bool_, count=length)
+        self.extras = {}
+
+        if self.column_type is None:
+            self.values = list(values)
+            return
+
+        dtype, check, fill = self.column_type
+        array = []
+        for row, value in enumerate(values):
+            if value is not None and check(value):
+                array.append(value)
+                continue
+            if value is not None:
+                self.extras[row] = value
+            array.append(fill)
+        self.values = numpy.array(array, dtype=dtype)
+
+    def valid(self, stop_on_required=True):
+        """ return a boolean array, True for each row valid for this field
+        """
+        field = self.field
+        if self.column_type is None:
+            check = field._compile_check(raw=True)
+            valid = numpy.fromiter((value is None or check(value) for value in self.values),
+                                   dtype=numpy.bool_, count=len(self.values))
+        else:
+            valid = numpy.ones(len(self.values), dtype=numpy.bool_)
+            if field.choices is not None:
+                choices = numpy.array(list(field.choices), dtype=object)
+                valid &= numpy.in1d(self.values.astype(object), choices) | ~self.present
+            if self.extras:
+                check = field._compile_check()
+                for row, value in self.extras.iteritems():
+                    valid[row] = check(value)
+
+        if stop_on_required and field.is_required:
+            valid &= self.present
+        return valid
+
+    def tolist(self):
+        """ return the python values, None for missing ones
+        """
+        if self.column_type is None:
+            return list(self.values)
+        if self.column_type[0] == 'datetime64[us]':
+            values = self.values.astype(object).tolist()
+        else:
+            values = self.values.tolist()
+        for row in numpy.flatnonzero(~self.present):
+            values[row] = None
+        for row, value in self.extras.iteritems():
+            values[row] = value
+        return values
+
+
+class DocumentBatch(object):
+    """ a columnar container for many instances of one Document class
+        IntegerField, FloatField, BooleanField and DateTimeField values
+        are stored in numpy arrays and validated column by column
+    """
+    def __init__(self, document_class, columns, length):
+        self.document_class = document_class
+        self.columns = columns
+        self.length = length
+
+    @classmethod
+    def from_dicts(cls, document_class, dicts):
+        """ create a batch from dicts as accepted by document_class(**dict)
+            aliases and defaults are applied like the constructor does
+        """
+        dicts = list(dicts)
+        input_names = document_class._input_names
+        rows = []
+        for data in dicts:
+            row = {}
+            for key, value in data.iteritems():
+                name = input_names.get(key)
+                if name is not None:
+                    row[name] = value
+            rows.append(row)
+
+        columns = {}
+        for name, field in document_class._fields.items():
+            default = field.default
+            values = []
+            for row in rows:
+                value = row.get(name)
+                if value is None and default is not None:
+                    value = default() if callable(default) else default
+                values.append(value)
+            columns[name] = Column(field, values)
+        return cls(document_class, columns, len(rows))
+
+    @classmethod
+    def from_documents(cls, document_class, documents):
+        """ create a batch from document_class instances
+        """
+        # exported values, as found in the database, eg packed ips as text
+        exports = [(name, field._export_converter())
+                   for name, field in document_class._fields.items()]
+
+        def exported(document):
+            data = {}
+            for name, export in exports:
+                value = getattr(document, name)
+                if export is not None and value is not None:
+                    value = export(value)
+                data[name] = value
+            return data
+        return cls.from_dicts(document_class,
+                              (exported(document) for document in documents))
+
+    def __len__(self):
+        return self.length
+
+    def column(self, name):
+        """ return the numpy array, or the list, holding the values of name
+        """
+        return self.columns[name].values
+
+    def validate(self, stop_on_required=True):
+        """ return a boolean array, True for each row where validate() would be True
+        """
+        valid = numpy.ones(self.length, dtype=numpy.bool_)
+        for column in self.columns.itervalues():
+            valid &= column.valid(stop_on_required)
+        return valid
+
+    def validate_partial(self):
+        return self.validate(stop_on_required=False)
+
+    def to_dicts(self):
+        """ return a list of dicts with field_name:value, None values are left out
+        """
+        rows = [{} for index in xrange(self.length)]
+        for name, column in self.columns.iteritems():
+            for row, value in zip(rows, column.tolist()):
+                if value is not None:
+                    row[name] = value
+        return rows
+
+    def to_documents(self):
+        """ return a list of document_class instances
+        """
+        document_class = self.document_class
+        return [document_class(**data) for data in self.to_dicts()]
@@ -0,0 +1,152 @@
+""" timing hooks for Document hot paths
+
+    the timed wrappers are only installed on Document and the fields while
+    at least one hook is registered, without hooks the original methods
+    are in place and nothing is measured
+"""
+import threading
+from functools import wraps
+from timeit import default_timer
+
+from . import BaseField, Document
+
+# Document method name -> event name
+_DOCUMENT_EVENTS = (
+    ('__init__', 'construct'),
+    ('validate', 'validate'),
+    ('validate_partial', 'validate_partial'),
+    ('dict_for_save', 'dict_for_save'),
+    ('dict_for_owner', 'dict_for_owner'),
+    ('dict_for_public', 'dict_for_public'),
+    ('dict_for_modified_fields', 'dict_for_modified_fields'),
+    ('_apply_filters', 'filters'),
+)
+
+# [(hook, classes or None)]
+_hooks = []
+# [(class, attribute name, original function)]
+_originals = []
+_lock = threading.Lock()
+
+
+def _emit(event, document_class, seconds):
+    for hook, classes in _hooks:
+        if classes is None or issubclass(document_class, classes):
+            hook(event, document_class, seconds)
+
+
+def _timed(function, event, document_argument):
+    """ return function wrapped to emit event with its duration
+        the document is found in the positional arguments at document_argument
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = default_timer()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = default_timer() - start
+            document = args[document_argument]
+            if document is not None:
+                _emit(event, document.__class__, seconds)
+    return wrapper
+
+
+def _field_classes():
+    """ return BaseField and all its subclasses defined so far
+    """
+    classes = [BaseField]
+    for klass in classes:
+        for subclass in klass.__subclasses__():
+            if subclass not in classes:
+                classes.append(subclass)
+    return classes
+
+
+def _install():
+    for name, event in _DOCUMENT_EVENTS:
+        function = Document.__dict__[name]
+        _originals.append((Document, name, function))
+        setattr(Document, name, _timed(function, event, 0))
+    # _prepare(self, instance, value) is reported for the instance class
+    for klass in _field_classes():
+        function = klass.__dict__.get('_prepare')
+        if function is not None:
+            _originals.append((klass, '_prepare', function))
+            setattr(klass, '_prepare', _timed(function, 'prepare', 1))
+
+
+def _uninstall():
+    while _originals:
+        klass, name, function = _originals.pop()
+        setattr(klass, name, function)
+
+
+def add_hook(hook, classes=None):
+    """ call hook(event, document_class, seconds) after each timed call
+        events are construct, validate, validate_partial, prepare, filters
+        and dict_for_save, dict_for_owner, dict_for_public, dict_for_modified_fields
+        classes limits the hook to documents of these classes (and subclasses)
+        times are inclusive: construct contains the prepare of its fields
+    """
+    if classes is not None and not isinstance(classes, tuple):
+        classes = tuple(classes) if isinstance(classes, list) else (classes,)
+    with _lock:
+        if not _hooks:
+            _install()
+        _hooks.append((hook, classes))
+
+
+def remove_hook(hook):
+    """ remove hook, the original methods are restored with the last hook
+    """
+    with _lock:
+        for index, (registered, classes) in enumerate(_hooks):
+            if registered is hook:
+                del _hooks[index]
+                break
+        else:
+            raise ValueError('hook not registered')
+        if not _hooks:
+            _uninstall()
+
+
+def installed():
+    """ return True while timed wrappers are in place
+    """
+    return bool(_originals)
+
+
+class Aggregator(object):
+    """ a hook keeping count, total and max seconds per class and event
+        add it with add_hook(aggregator) and read it with snapshot()
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event, document_class, seconds):
+        key = (document_class.__name__, event)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = [1, seconds, seconds]
+                return
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def snapshot(self):
+        """ return {class name: {event: {'count', 'total', 'max'}}}
+        """
+        result = {}
+        with self._lock:
+            for (class_name, event), (count, total, maximum) in self._stats.items():
+                result.setdefault(class_name, {})[event] = {
+                    'count': count, 'total': total, 'max': maximum}
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
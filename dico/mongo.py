@@ -1,12 +1,22 @@
 try:
+    import bson
     import bson.objectid
+    from pymongo import InsertOne, UpdateOne
 except ImportError:
     raise ImportError(
         'Using the ObjectIdField requires Pymongo. '
     )
 
-from . import BaseField, Document, rename_field
+from . import BaseField, Document, EmbeddedDocumentField, ListField, NotifyParentList
+from . import ValidationException, rename_field
+from . import _PLAN_EMBEDDED, _PLAN_EMBEDDED_LIST, _MISSING, _class_attribute
+from collections import OrderedDict
 from functools import partial
+import calendar
+import datetime
+import struct
+import time
+import weakref
 
 
 class ObjectIdField(BaseField):
@@ -14,3 +24,452 @@ class ObjectIdField(BaseField):
         if not isinstance(value, (bson.objectid.ObjectId)):
             return False
         return True
+
+    def _json_converter(self):
+        return str
+
+
+def _minimal_paths(paths):
+    """ return the sorted paths without those already covered by a parent path
+    """
+    kept = set()
+    for path in sorted(paths, key=len):
+        parts = path.split('.')
+        if not any('.'.join(parts[:i]) in kept for i in range(1, len(parts))):
+            kept.add(path)
+    return sorted(kept)
+
+
+def _value_at(document, path):
+    """ return (value, field) found at a dotted path, value is None
+        if it does not exist
+    """
+    value = document
+    field = None
+    for part in path.split('.'):
+        if isinstance(value, Document):
+            field = value._fields[part]
+            value = getattr(value, part)
+        elif isinstance(value, list):
+            field = field.subfield if isinstance(field, ListField) else None
+            try:
+                value = value[int(part)]
+            except IndexError:
+                return None, field
+        else:
+            return None, field
+    return value, field
+
+
+def _embedded_class(field):
+    """ return the document class stored by an embedded or list field or None
+    """
+    if isinstance(field, ListField):
+        field = field.subfield
+    if isinstance(field, EmbeddedDocumentField):
+        return field.field_type
+    return None
+
+
+def _stored_path(document_class, path):
+    """ return the dotted path with field names replaced by their db_name
+    """
+    parts = []
+    for part in path.split('.'):
+        if part.isdigit() or document_class is None:
+            parts.append(part)
+            continue
+        parts.append(document_class._db_names[part])
+        document_class = _embedded_class(document_class._fields[part])
+    return '.'.join(parts)
+
+
+def _value_for_save(value, field):
+    if isinstance(value, Document):
+        return value.dict_for_save()
+    if isinstance(value, list):
+        subfield = field.subfield if isinstance(field, ListField) else None
+        return [_value_for_save(entry, subfield) for entry in value]
+    export = field._export_converter() if field is not None else None
+    return value if export is None else export(value)
+
+
+def _list_operation(value, field, path, paths):
+    """ return (operator, argument) for a list whose only changes are
+        logged push, pop or pull operations, None if it has to be rewritten
+    """
+    if not isinstance(value, NotifyParentList) or not value._ops:
+        return None
+    # changes inside elements can not be combined with a list operation
+    prefix = path + '.'
+    if any(other.startswith(prefix) for other in paths):
+        return None
+    op, values = value._ops[0]
+    if op == 'pop':
+        return '$pop', values
+    values = [_value_for_save(entry, field.subfield) for entry in values]
+    if op == 'push':
+        return '$push', {'$each': values}
+    return '$pullAll', values
+
+
+def dict_for_update(document, validate=True):
+    """ return a mongo update document with $set and $unset for the
+        minimal dotted paths modified in document
+        lists only appended, popped or removed from use $push, $pop or $pullAll
+        will raise ValidationError if partial modified data not valid
+    """
+    if validate and not document.validate_partial():
+        raise ValidationException()
+
+    paths = document.modified_paths()
+    update = {}
+    for path in _minimal_paths(paths):
+        value, field = _value_at(document, path)
+        operation = _list_operation(value, field, path, paths)
+        if operation is not None:
+            operator, argument = operation
+        elif value is None:
+            operator, argument = '$unset', ''
+        else:
+            operator, argument = '$set', _value_for_save(value, field)
+        update.setdefault(operator, {})[_stored_path(document.__class__, path)] = argument
+    return update
+
+
+_PACK_INT = struct.Struct('<i').pack
+_PACK_LONG = struct.Struct('<q').pack
+_PACK_DOUBLE = struct.Struct('<d').pack
+
+
+def _save_renames(filters):
+    """ return {old_name: new_name} if every filter is a
+        partial(rename_field, old_name, new_name), None otherwise
+    """
+    renames = {}
+    for filter in filters:
+        if not isinstance(filter, partial) or filter.func is not rename_field \
+                or len(filter.args) != 2 or filter.keywords:
+            return None
+        old_name, new_name = filter.args
+        renames[old_name] = new_name
+    return renames
+
+
+def _cstring(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return name + '\x00'
+
+
+def _bson_document(body):
+    return _PACK_INT(len(body) + 5) + body + '\x00'
+
+
+def _bson_element(name, value):
+    """ return the BSON element for name and value, a cstring name
+        types not handled here are encoded by pymongo
+    """
+    if value is None:
+        return '\x0a' + name
+    if value is True:
+        return '\x08' + name + '\x01'
+    if value is False:
+        return '\x08' + name + '\x00'
+    if isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return '\x02' + name + _PACK_INT(len(value) + 1) + value + '\x00'
+    if isinstance(value, int):
+        if -2147483648 <= value <= 2147483647:
+            return '\x10' + name + _PACK_INT(value)
+        return '\x12' + name + _PACK_LONG(value)
+    if isinstance(value, long):
+        if -9223372036854775808 <= value <= 9223372036854775807:
+            return '\x12' + name + _PACK_LONG(value)
+        # out of the int64 range, pymongo raises OverflowError below
+    if isinstance(value, float):
+        return '\x01' + name + _PACK_DOUBLE(value)
+    if isinstance(value, bson.objectid.ObjectId):
+        return '\x07' + name + value.binary
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = value - value.utcoffset()
+        millis = calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+        return '\x09' + name + _PACK_LONG(millis)
+    if isinstance(value, Document):
+        return '\x03' + name + bson_for_save(value)
+    if isinstance(value, (list, tuple)):
+        return '\x04' + name + _bson_document(''.join(
+            _bson_element(_cstring(str(index)), entry)
+            for index, entry in enumerate(value)))
+    if isinstance(value, dict):
+        return '\x03' + name + _bson_document(''.join(
+            _bson_element(_cstring(key), entry) for key, entry in value.iteritems()))
+    # strip the document length and the trailing null byte
+    return bson.BSON.encode({name[:-1]: value})[4:-1]
+
+
+def bson_for_save(document):
+    """ return dict_for_save() encoded as BSON bytes, walking the document
+        fields directly instead of building the dict first
+        rename_field filters are applied on the names, other save filters
+        fall back on encoding dict_for_save()
+        raise ValidationError if not valid
+    """
+    fields_list, entries, filters, field_names = document._valid_plan('save')
+    renames = _save_renames(filters)
+    if renames is None:
+        return bson.BSON.encode(document.dict_for_save())
+
+    elements = []
+    for key, read, kind, method_name, export, to_json in entries:
+        value = read(document)
+        if value is None:
+            continue
+        name = _cstring(renames.get(key, key))
+        if kind is _PLAN_EMBEDDED:
+            elements.append('\x03' + name + bson_for_save(value))
+        elif kind is _PLAN_EMBEDDED_LIST:
+            elements.append('\x04' + name + _bson_document(''.join(
+                '\x03' + _cstring(str(index)) + bson_for_save(entry)
+                for index, entry in enumerate(value))))
+        else:
+            if export is not None:
+                value = export(value)
+            elements.append(_bson_element(name, value))
+    return _bson_document(''.join(elements))
+
+
+def _saved_path(document_class, path):
+    """ return a dotted path of field names as stored by dict_for_save, with
+        db_name and rename_field filters applied at each level, or None when
+        it can not be known: not a field or a save filter other than rename_field
+    """
+    parts = []
+    for part in path.split('.'):
+        if document_class is None or part.isdigit():
+            parts.append(part)
+            continue
+        renames = _save_renames(document_class._plan('save')[2])
+        field = document_class._fields.get(part)
+        if renames is None or field is None:
+            return None
+        saved_name = document_class._db_names[part]
+        parts.append(renames.get(saved_name, saved_name))
+        document_class = _embedded_class(field)
+    return '.'.join(parts)
+
+
+def _projection_paths(document_class, visibility):
+    """ return the set of stored dotted paths read by dict_for_<visibility>
+        or None when they can not be known: a property without depends_on
+        or a pre_save_filter other than rename_field
+    """
+    renames = _save_renames(document_class._plan('save')[2])
+    if renames is None:
+        return None
+    paths = set()
+    pending = list(document_class._plan(visibility)[0])
+    seen = set()
+    while pending:
+        key = pending.pop()
+        if key in seen:
+            continue
+        seen.add(key)
+        name, dot, rest = key.partition('.')
+        field = document_class._fields.get(name)
+        if field is None:
+            attribute = _class_attribute(document_class, name, _MISSING)
+            if attribute is _MISSING:
+                raise KeyError(name)
+            depends = getattr(getattr(attribute, 'fget', None), 'depends_on', None)
+            if depends is None:
+                return None
+            pending.extend(depends)
+            continue
+
+        # the whole value unless the embedded paths are known
+        suffixes = ['']
+        embedded_class = _embedded_class(field)
+        if rest:
+            # a dotted depends_on path, stored with the names of the embedded class
+            stored_rest = _saved_path(embedded_class, rest)
+            if stored_rest is not None:
+                suffixes = ['.' + stored_rest]
+        elif embedded_class is not None:
+            child_paths = _projection_paths(embedded_class, visibility)
+            if child_paths:
+                suffixes = ['.' + path for path in child_paths]
+        # the value may be stored under its saved name or any alias
+        saved_name = document_class._db_names[name]
+        names = set([renames.get(saved_name, saved_name)])
+        names.update(field.aliases or ())
+        for stored_name in names:
+            for suffix in suffixes:
+                paths.add(stored_name + suffix)
+    return paths
+
+
+def projection(document_class, visibility='public'):
+    """ return a find() projection fetching only what dict_for_<visibility>
+        needs, embedded documents and lists give dotted paths
+        properties add the fields declared with dico.depends_on
+        return None when the whole document is needed
+    """
+    paths = _projection_paths(document_class, visibility)
+    if paths is None:
+        return None
+    if not paths:
+        # {'_id': 0} alone would exclude _id and fetch everything else
+        return {'_id': 1}
+    result = dict((path, 1) for path in _minimal_paths(paths))
+    if '_id' not in result:
+        result['_id'] = 0
+    return result
+
+
+def bson_for_insert(documents):
+    """ return a list of RawBSONDocument from bson_for_save for each document
+        ready to be passed to insert_many
+    """
+    from bson.raw_bson import RawBSONDocument
+    return [RawBSONDocument(bson_for_save(document)) for document in documents]
+
+
+def iter_cursor(document_class, cursor, chunk_size=100, **kwargs):
+    """ stream documents from a pymongo cursor, see Document.iter_from
+        the cursor batch size is aligned on chunk_size
+    """
+    if hasattr(cursor, 'batch_size'):
+        cursor = cursor.batch_size(chunk_size)
+    return document_class.iter_from(cursor, chunk_size=chunk_size, **kwargs)
+
+
+class Session(object):
+    """ a unit of work writing the changes of many documents with bulk_write
+        added documents are inserted, registered ones are updated with
+        dict_for_update when they change, then committed
+        when max_pending documents are waiting, or the oldest change is older
+        than max_delay seconds, pending documents are flushed by the next add,
+        register or flush_due call, never while a document is being changed
+        not thread safe, use one session per thread
+    """
+    def __init__(self, collection, ordered=True, batch_size=1000,
+                 max_pending=None, max_delay=None, id_field='id', id_key='_id'):
+        self.collection = collection
+        self.ordered = ordered
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.id_field = id_field
+        self.id_key = id_key
+        # id(document) -> document, in order of first change
+        self._pending = OrderedDict()
+        self._new = set()
+        self._first_change = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def _attach(self, document):
+        document._session_ref = weakref.ref(self)
+
+    def add(self, document):
+        """ insert document on the next flush then track its changes
+        """
+        self._flush_due()
+        self._attach(document)
+        self._new.add(id(document))
+        self._mark(document)
+
+    def register(self, document):
+        """ track the changes of a document already in the collection
+        """
+        self._flush_due()
+        self._attach(document)
+        if document.modified_paths():
+            self._mark(document)
+
+    def discard(self, document):
+        """ stop tracking document, its pending changes are dropped
+        """
+        document._session_ref = None
+        self._pending.pop(id(document), None)
+        self._new.discard(id(document))
+
+    def _mark(self, document):
+        if not self._pending:
+            self._first_change = time.time()
+        self._pending[id(document)] = document
+
+    def _changed(self, document):
+        """ called by BaseField._changed before the change is applied
+            only marks document, nothing is written or raised from here
+        """
+        if id(document) not in self._pending:
+            self._mark(document)
+
+    def is_due(self):
+        """ return True when max_pending or max_delay is reached
+        """
+        if not self._pending:
+            return False
+        return self.max_pending is not None and len(self._pending) >= self.max_pending or \
+            self.max_delay is not None and time.time() - self._first_change >= self.max_delay
+
+    def flush_due(self):
+        """ flush when max_pending or max_delay is reached
+            return the list of bulk_write results, or None when nothing was due
+        """
+        if self.is_due():
+            return self.flush()
+        return None
+
+    def _flush_due(self):
+        # automatic flush of add and register, an invalid document keeps
+        # everything pending, the ValidationException is raised by flush()
+        try:
+            self.flush_due()
+        except ValidationException:
+            pass
+
+    def __len__(self):
+        return len(self._pending)
+
+    def operations(self):
+        """ return the bulk write operations for the pending documents
+            raise ValidationException if one of them is not valid
+        """
+        operations = []
+        for key, document in self._pending.iteritems():
+            if key in self._new:
+                if not document.validate():
+                    raise ValidationException()
+                operations.append(InsertOne(document.dict_for_save()))
+                continue
+            update = dict_for_update(document)
+            if update:
+                operations.append(UpdateOne(
+                    {self.id_key: getattr(document, self.id_field)}, update))
+        return operations
+
+    def flush(self):
+        """ write the pending documents in batches of batch_size operations
+            return the list of bulk_write results
+        """
+        operations = self.operations()
+        results = []
+        for start in xrange(0, len(operations), self.batch_size):
+            results.append(self.collection.bulk_write(
+                operations[start:start + self.batch_size], ordered=self.ordered))
+        for document in self._pending.itervalues():
+            document.commit()
+        self._pending.clear()
+        self._new.clear()
+        self._first_change = None
+        return results
@@ -0,0 +1,80 @@
+from itertools import islice
+from multiprocessing import Pool
+
+from . import Document
+
+
+def _chunks(iterable, chunk_size):
+    """ yield lists of at most chunk_size elements
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _validate_chunk(args):
+    document_class, chunk, stop_on_required = args
+    result = []
+    for data in chunk:
+        if isinstance(data, Document):
+            result.append(data.validate() if stop_on_required else data.validate_partial())
+        else:
+            result.append(document_class.validate_dict(data, stop_on_required))
+    return result
+
+
+def _save_chunk(args):
+    document_class, chunk, json_compliant = args
+    result = []
+    for data in chunk:
+        if not isinstance(data, Document):
+            data = document_class(**data)
+        if data.validate():
+            result.append(data.dict_for_save(json_compliant))
+        else:
+            result.append(None)
+    return result
+
+
+def _map(function, document_class, iterable, option, chunk_size, processes, pool):
+    """ run function over chunks of iterable in a process pool
+        and return the results flattened in input order
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = Pool(processes)
+    try:
+        results = []
+        tasks = ((document_class, chunk, option)
+                 for chunk in _chunks(iterable, chunk_size))
+        for chunk_result in pool.imap(function, tasks):
+            results.extend(chunk_result)
+        return results
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+
+def validate(document_class, iterable, stop_on_required=True,
+             chunk_size=1000, processes=None, pool=None):
+    """ return a list of booleans, one for each dict or document of iterable
+        in the same order, validation is shared between processes
+        document_class must be importable by the worker processes
+        dicts are validated with validate_dict
+    """
+    return _map(_validate_chunk, document_class, iterable, stop_on_required,
+                chunk_size, processes, pool)
+
+
+def dicts_for_save(document_class, iterable, json_compliant=False,
+                   chunk_size=1000, processes=None, pool=None):
+    """ return a list of dict_for_save(), or None for invalid ones, for each
+        dict or document of iterable in the same order
+        documents are built and serialized by the worker processes
+    """
+    return _map(_save_chunk, document_class, iterable, json_compliant,
+                chunk_size, processes, pool)
@@ -4,9 +4,37 @@ import re
 import datetime
 import dico.mongo
 from bson.objectid import ObjectId
+import bson
 import random
 from functools import partial
 import copy
+import json
+import StringIO
+import gc
+import weakref
+import cPickle
+import pickle
+import dico.parallel
+import dico.instrument
+try:
+    import numpy
+    import dico.batch
+except ImportError:
+    numpy = None
+
+
+# pickled documents and process pools need importable classes
+class PickledToken(dico.Document):
+    secret = dico.StringField(required=True)
+
+
+class PickledUser(dico.Document):
+    id = dico.IntegerField(required=True)
+    name = dico.StringField()
+    token = dico.EmbeddedDocumentField(PickledToken)
+    tokens = dico.ListField(dico.EmbeddedDocumentField(PickledToken))
+    tags = dico.ListField(dico.StringField())
+
 
 class TestDico(unittest.TestCase):
     def setUp(self):
@@ -253,6 +281,49 @@ class TestDico(unittest.TestCase):
         user.id = 'toto'
         self.assertFalse(user.validate())
 
+        # unhashable values are not in hashable choices
+        class Item(dico.Document):
+            kind = dico.StringField(choices=['a', 'b'])
+        item = Item()
+        item.kind = ['a']
+        self.assertFalse(item.validate())
+        self.assertEqual(item.validation_errors(), [('kind', 'choices')])
+        self.assertFalse(Item.validate_dict({'kind': ['a']}))
+
+    def test_compiled_validator(self):
+        class CustomField(dico.IntegerField):
+            def _validate(self, value):
+                return value == 42
+
+        class User(dico.Document):
+            id = CustomField()
+            tags = dico.ListField(dico.StringField(max_length=3))
+            status = dico.StringField(choices=['on', 'off'])
+            coords = dico.ListField(dico.IntegerField(), choices=[[1, 2], [3, 4]])
+
+        user = User()
+        user.coords = [1, 2]
+        user.id = 41
+        self.assertFalse(user.validate())
+        user.id = 42
+        self.assertTrue(user.validate())
+
+        user.tags = ['abc', 'abcd']
+        self.assertFalse(user.validate())
+        user.tags = ['abc', u'ab']
+        self.assertTrue(user.validate())
+
+        user.status = 'idle'
+        self.assertFalse(user.validate_partial())
+        user.status = 'on'
+        self.assertTrue(user.validate_partial())
+
+        # unhashable choices are still supported
+        user.coords = [1, 3]
+        self.assertFalse(user.validate())
+        user.coords = [3, 4]
+        self.assertTrue(user.validate())
+
     def test_field(self):
         class User(dico.Document):
             id = dico.IntegerField()
@@ -349,6 +420,37 @@ class TestDico(unittest.TestCase):
         id = user.id
         self.assertEqual(id, user.dict_for_save()['id'])
 
+    def test_regex_cache(self):
+        class User(dico.Document):
+            email = dico.EmailField(cache_size=2)
+            url = dico.URLField()
+
+        self.assertIsNone(User._fields['url'].regex_cache)
+        cache = User._fields['email'].regex_cache
+
+        user = User()
+        for email in ['bob@sponge.com', 'bob@sponge.com', 'sponge.com', 'bob@sponge.com']:
+            user.email = email
+            user.validate()
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'evictions': 0,
+                                         'size': 2, 'max_size': 2})
+
+        user.email = 'sponge.com'
+        self.assertFalse(user.validate())
+        user.email = 'paul@sponge.com'
+        self.assertTrue(user.validate())
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 2)
+
+        # least recently used entry was evicted
+        misses = cache.stats()['misses']
+        user.email = 'bob@sponge.com'
+        self.assertTrue(user.validate())
+        self.assertEqual(cache.stats()['misses'], misses + 1)
+
+        cache.clear()
+        self.assertEqual(cache.stats()['size'], 0)
+
     def test_url_field(self):
         class User(dico.Document):
             blog_url = dico.URLField(max_length=64)
@@ -395,6 +497,15 @@ class TestDico(unittest.TestCase):
             error = True
         self.assertTrue(error)
 
+        self.assertRaises(ValueError, User, _id=1, aid=2)
+        self.assertEqual(User._input_names, {'id': 'id', '_id': 'id', 'aid': 'id'})
+
+        class Admin(User):
+            level = dico.IntegerField(aliases=['lvl'])
+
+        admin = Admin(_id=3, lvl=2)
+        self.assertEqual((admin.id, admin.level), (3, 2))
+
     def test_float_field(self):
         class User(dico.Document):
             lat = dico.FloatField()
@@ -436,6 +547,74 @@ class TestDico(unittest.TestCase):
         user.ip = 'bob'
         self.assertFalse(user.validate())
 
+    def test_packed_ip_address(self):
+        class Log(dico.Document):
+            ip = dico.IPAddressField(packed=True)
+            ips = dico.ListField(dico.IPAddressField(packed=True))
+
+            public_fields = ['ip', 'ips']
+
+        log = Log(ip='194.117.200.10', ips=[u'::1', '127.0.0.1'])
+        self.assertEqual(log.ip, '\xc2\x75\xc8\x0a')
+        self.assertEqual(len(log.ips[0]), 16)
+        self.assertTrue(log.validate())
+        self.assertEqual(log.dict_for_public(),
+                         {'ip': '194.117.200.10', 'ips': ['::1', '127.0.0.1']})
+        self.assertEqual(json.loads(dico.dumps(log))['ip'], '194.117.200.10')
+        self.assertEqual(bson.BSON(dico.mongo.bson_for_save(log)).decode()['ip'],
+                         '194.117.200.10')
+
+        log.ip = '2001:0db8:85a3:0042:0000:8a2e:0370:7334'
+        self.assertTrue(log.validate())
+        self.assertEqual(log.dict_for_modified_fields(),
+                         {'ip': '2001:db8:85a3:42:0:8a2e:370:7334'})
+
+        log.ips.append('10.0.0.1')
+        self.assertEqual(dico.mongo.dict_for_update(log)['$push'],
+                         {'ips': {'$each': ['10.0.0.1']}})
+
+        # invalid texts are kept invalid, even with the size of a packed address
+        for bad in ['abcd', u'abcd', '1234', 'bob', 'not an ip addres', 4]:
+            log.ip = bad
+            self.assertFalse(log.validate())
+            self.assertEqual(log.ip, bad)
+
+        # a packed value copied from another document
+        other = Log(ip='10.1.2.3', ips=['::1'])
+        log.ip = other.ip
+        log.ips = other.ips
+        self.assertTrue(log.validate())
+        self.assertEqual(log.dict_for_public(), {'ip': '10.1.2.3', 'ips': ['::1']})
+        self.assertEqual(Log(**other.dict_for_save()).ip, other.ip)
+        if numpy is not None:
+            batch = dico.batch.DocumentBatch.from_documents(Log, [other])
+            self.assertTrue(batch.validate()[0])
+            copied = batch.to_documents()[0]
+            self.assertTrue(copied.validate())
+            self.assertEqual(copied.ip, other.ip)
+
+        self.assertTrue(Log.validate_dict({'ip': '::1'}))
+        self.assertFalse(Log.validate_dict({'ip': 'abcd'}))
+
+        field = Log._fields['ip']
+        self.assertEqual(field.validate_batch(['::1', '1.2.3.4', '1.2.3', 'a:b', 5]),
+                         [True, True, False, False, False])
+        self.assertEqual(field.to_text(field.pack('::ffff:1.2.3.4')), '::ffff:1.2.3.4')
+        self.assertRaises(ValueError, field.pack, 'bob')
+
+        class User(dico.Document):
+            ip = dico.IPAddressField()
+        user = User(ip=4)
+        self.assertFalse(user.validate())
+        # only packed fields prepare their values, empty entries are kept
+        self.assertFalse(hasattr(User._fields['ip'], '_prepare'))
+
+        class Hosts(dico.Document):
+            ips = dico.ListField(dico.IPAddressField())
+        hosts = Hosts(ips=['1.2.3.4', ''])
+        self.assertEqual(hosts.ips, ['1.2.3.4', ''])
+        self.assertFalse(hosts.validate())
+
     def test_list_field(self):
         class User(dico.Document):
             friends = dico.ListField(dico.IntegerField())
@@ -521,8 +700,7 @@ class TestDico(unittest.TestCase):
 
         user = User()
         user.id = 53
-        #TODO: allow a direct callable
-        #self.assertIn('_id', user.dict_for_save())
+        self.assertIn('_id', user.dict_for_save())
 
     def test_pre_save_partial(self):
         class User(dico.Document):
@@ -562,6 +740,1103 @@ class TestDico(unittest.TestCase):
             error = True
         self.assertTrue(error)
 
+    def test_serialization_plan(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+            public_fields = ['secret']
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            name = dico.StringField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            @property
+            def label(self):
+                return 'user %s' % self.id
+
+            public_fields = ['name', 'label', 'token', 'tokens']
+
+        user = User(id=1, name='Bob', token={'secret': 'a'}, tokens=[{'secret': 'b'}])
+        self.assertEqual(user.dict_for_public(), {'name': 'Bob', 'label': 'user 1',
+            'token': {'secret': 'a'}, 'tokens': [{'secret': 'b'}]})
+        self.assertIn('public', User._plans)
+
+        # plan is reused but values are read on each call
+        user.name = 'Paul'
+        user.token = None
+        self.assertEqual(user.dict_for_public()['name'], 'Paul')
+        self.assertNotIn('token', user.dict_for_public())
+
+        save_dict = user.dict_for_save()
+        self.assertEqual(save_dict['tokens'], [{'secret': 'b'}])
+        self.assertIsInstance(user.tokens[0], Token)
+
+        # properties are evaluated once per call, not by the validation
+        class Counted(dico.Document):
+            name = dico.StringField()
+            calls = []
+
+            @property
+            def label(self):
+                self.calls.append(1)
+                return self.name
+
+            public_fields = ['name', 'label']
+
+        counted = Counted(name='Bob')
+        counted.dict_for_public()
+        counted.dict_for_public()
+        self.assertEqual(len(Counted.calls), 2)
+
+    def test_validate_dict(self):
+        class Token(dico.Document):
+            secret = dico.StringField(required=True, max_length=8)
+            kind = dico.StringField(choices=['a', 'b'])
+
+        class User(dico.Document):
+            id = dico.IntegerField(required=True, aliases=['_id'])
+            count = dico.IntegerField(default=1)
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token), max_length=2)
+
+        self.assertTrue(User.validate_dict({'_id': 1}))
+        self.assertFalse(User.validate_dict({}))
+        self.assertTrue(User.validate_dict({}, stop_on_required=False))
+        self.assertFalse(User.validate_dict({'id': 1, '_id': 2}))
+        self.assertFalse(User.validate_dict({'id': 'a'}))
+
+        self.assertTrue(User.validate_dict({'id': 1, 'token': {'secret': 'abc'}}))
+        self.assertFalse(User.validate_dict({'id': 1, 'token': {}}))
+        self.assertFalse(User.validate_dict({'id': 1, 'token': {'secret': 'abc', 'kind': 'c'}}))
+        self.assertTrue(User.validate_dict({'id': 1, 'token': Token(secret='abc')}))
+        self.assertFalse(User.validate_dict({'id': 1, 'token': 3}))
+
+        self.assertTrue(User.validate_dict({'id': 1, 'tokens': [{'secret': 'abc'}]}))
+        self.assertFalse(User.validate_dict({'id': 1, 'tokens': [{'secret': 'abcdefghi'}]}))
+        self.assertFalse(User.validate_dict({'id': 1, 'tokens': [{'secret': 'a'}] * 3}))
+
+        records = [{'id': 1}, {'id': 'x'}, {'_id': 3, 'tokens': [{}]},
+                   {'id': 4, 'tokens': [None, {'secret': 'a'}]},
+                   {'id': 5, 'tokens': [None, 0, {'secret': 'a'}, {'secret': 'b'}]}]
+        self.assertEqual(list(User.validate_many(records)), [True, False, False, True, True])
+        for record in records:
+            self.assertEqual(User(**dict(record)).validate(), User.validate_dict(record))
+
+    def test_lazy_hydration(self):
+        class Token(dico.Document):
+            secret = dico.StringField(required=True)
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            lazy_hydration = True
+
+        user = User(id=1, token={'secret': 'a'}, tokens=[{'secret': 'b'}, {'secret': 'c'}])
+        self.assertEqual(user.id, 1)
+        self.assertEqual(set(user._raw_values), set(['token', 'tokens']))
+
+        self.assertIsInstance(user.token, Token)
+        self.assertNotIn('token', user._raw_values)
+        self.assertIsInstance(user.tokens, dico.NotifyParentList)
+        self.assertEqual(user.tokens[1].secret, 'c')
+
+        user.tokens[1].secret = 'd'
+        self.assertIn('tokens', user.modified_fields())
+
+        # serialization and validation hydrate what they need
+        user = User(id=1, tokens=[{'secret': 'b'}])
+        self.assertEqual(user.dict_for_save()['tokens'], [{'secret': 'b'}])
+        user = User(id=1, token={})
+        self.assertFalse(user.validate())
+
+        # setting a field drops its raw value
+        user = User(id=1, token={'secret': 'a'})
+        user.token = Token(secret='b')
+        self.assertEqual(user.token.secret, 'b')
+        self.assertNotIn('token', user._raw_values)
+
+    def test_shared_defaults(self):
+        class User(dico.Document):
+            id = dico.IntegerField()
+            tags = dico.ListField(dico.StringField(), default=['new'])
+            friends = dico.ListField(dico.IntegerField())
+
+            public_fields = ['id', 'tags', 'friends']
+
+        user = User(id=1)
+        other = User(id=2)
+        self.assertTrue(user.validate())
+        self.assertEqual(user.dict_for_public(), {'id': 1, 'tags': ['new'], 'friends': []})
+        self.assertEqual(json.loads(dico.dumps(user, 'public')), {'id': 1, 'tags': ['new'], 'friends': []})
+        # read only paths do not store the default on the document
+        self.assertRaises(AttributeError, object.__getattribute__, user, 'tags')
+        self.assertIs(User._readers['tags'](user), User._readers['tags'](other))
+
+        # the exported list is a copy, never the shared default
+        exported = user.dict_for_save()['tags']
+        exported.append('x')
+        self.assertEqual(other.dict_for_save()['tags'], ['new'])
+        self.assertRaises(TypeError, User._readers['tags'](user).append, 'x')
+
+        # accessing the attribute gives a list of its own to modify
+        user.tags.append('old')
+        self.assertEqual(user.tags, ['new', 'old'])
+        self.assertEqual(other.tags, ['new'])
+        self.assertIn('tags', user.modified_fields())
+        self.assertEqual(user.dict_for_save()['tags'], ['new', 'old'])
+
+    def test_no_reference_cycles(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+        class User(dico.Document):
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+        gc.disable()
+        try:
+            user = User(token={'secret': 'a'}, tokens=[{'secret': 'b'}])
+            user.tokens.append(Token(secret='c'))
+            self.assertIs(user.token._parent, user)
+            self.assertIs(user.tokens._parent, user)
+            self.assertIs(user.tokens[1]._parent, user)
+
+            user_ref = weakref.ref(user)
+            tokens_ref = weakref.ref(user.tokens)
+            token = user.token
+            del user
+            self.assertIsNone(user_ref())
+            self.assertIsNone(tokens_ref())
+            # a child kept alive is detached from its freed parent
+            self.assertIsNone(token._parent)
+            token.secret = 'd'
+            self.assertEqual(token.modified_fields(), set(['secret']))
+        finally:
+            gc.enable()
+
+    def test_pickle(self):
+        user = PickledUser(id=1, token={'secret': 'a'}, tokens=[{'secret': 'b'}])
+        user.name = 'bob'
+        user.tags.append('new')
+        for dumps, protocol in ((pickle.dumps, 0), (cPickle.dumps, 2)):
+            copied = cPickle.loads(dumps(user, protocol))
+            self.assertEqual(copied.dict_for_save(), user.dict_for_save())
+            self.assertEqual(copied.modified_fields(), set(['name', 'tags']))
+            self.assertEqual(copied.tags._ops, [('push', ['new'])])
+            self.assertIs(copied.token._parent, copied)
+            self.assertIs(copied.tokens._parent, copied)
+            self.assertIs(copied.tokens[0]._parent, copied)
+
+            copied.tokens[0].secret = 'c'
+            self.assertIn('tokens.0.secret', copied.modified_paths())
+            copied.tags.append('old')
+            self.assertEqual(copied.tags._ops, [('push', ['new', 'old'])])
+            self.assertNotIn('old', user.tags)
+
+        # lazy values are kept raw
+        PickledUser.lazy_hydration = True
+        try:
+            user = PickledUser(id=1, token={'secret': 'a'})
+            copied = cPickle.loads(cPickle.dumps(user, 2))
+            self.assertEqual(copied._raw_values, {'token': {'secret': 'a'}})
+            self.assertIs(copied.token._parent, copied)
+        finally:
+            PickledUser.lazy_hydration = False
+
+    def test_parallel(self):
+        dicts = [{'id': index, 'token': {'secret': str(index)}} for index in range(20)]
+        dicts[3] = {'name': 'no id'}
+        dicts[11]['token'] = {}
+
+        valid = dico.parallel.validate(PickledUser, dicts, chunk_size=3, processes=2)
+        self.assertEqual(valid, [index not in (3, 11) for index in range(20)])
+        self.assertEqual(dico.parallel.validate(PickledUser, dicts, stop_on_required=False,
+            chunk_size=3, processes=2), [index != 11 for index in range(20)])
+
+        saved = dico.parallel.dicts_for_save(PickledUser, dicts, chunk_size=4, processes=2)
+        self.assertEqual(len(saved), 20)
+        self.assertIsNone(saved[3])
+        self.assertIsNone(saved[11])
+        self.assertEqual(saved[5], PickledUser(**dicts[5]).dict_for_save())
+
+        documents = [PickledUser(**data) for data in dicts[:5]]
+        self.assertEqual(dico.parallel.validate(PickledUser, documents, chunk_size=2,
+            processes=2), [True, True, True, False, True])
+
+    def test_identity_map(self):
+        class User(dico.Document):
+            id = dico.mongo.ObjectIdField(aliases=['_id'])
+            name = dico.StringField()
+
+            identity_map = dico.IdentityMap('id', max_size=2)
+
+        first_id, second_id, third_id = ObjectId(), ObjectId(), ObjectId()
+        user = User.load({'_id': first_id, 'name': 'bob'})
+        self.assertIs(User.load({'_id': first_id, 'name': 'bob'}), user)
+        self.assertIs(User.load({'id': first_id}), user)
+        self.assertEqual(User.identity_map.stats(),
+            {'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1, 'max_size': 2})
+
+        # documents without id are not cached
+        self.assertIsNot(User.load({'name': 'alice'}), User.load({'name': 'alice'}))
+
+        # least recently used documents are evicted
+        User.load({'_id': second_id})
+        User.load({'_id': first_id})
+        User.load({'_id': third_id})
+        self.assertIsNone(User.identity_map.get(User, second_id))
+        self.assertIs(User.identity_map.get(User, first_id), user)
+        self.assertEqual(User.identity_map.stats()['evictions'], 1)
+
+        User.identity_map.discard(User, first_id)
+        self.assertIsNot(User.load({'_id': first_id}), user)
+
+        # iter_from goes through the identity map
+        users = list(User.iter_from([{'_id': third_id}, {'_id': third_id}]))
+        self.assertIs(users[0], users[1])
+
+        User.identity_map.clear()
+        self.assertEqual(User.identity_map.stats()['size'], 0)
+
+        class Token(dico.Document):
+            id = dico.IntegerField()
+        self.assertIsInstance(Token.load({'id': 1}), Token)
+        self.assertIsNot(Token.load({'id': 1}), Token.load({'id': 1}))
+
+    def test_session(self):
+        from pymongo import InsertOne, UpdateOne
+
+        class FakeCollection(object):
+            def __init__(self):
+                self.calls = []
+
+            def bulk_write(self, requests, ordered=True):
+                self.calls.append((list(requests), ordered))
+                return len(requests)
+
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+        class User(dico.Document):
+            id = dico.IntegerField(required=True)
+            name = dico.StringField()
+            friends = dico.ListField(dico.IntegerField())
+            token = dico.EmbeddedDocumentField(Token)
+
+        collection = FakeCollection()
+        session = dico.mongo.Session(collection, ordered=False, batch_size=2)
+        new_user = User(id=1, name='new')
+        session.add(new_user)
+        users = [User(id=index, friends=[1]) for index in (2, 3, 4)]
+        for user in users:
+            session.register(user)
+        self.assertEqual(len(session), 1)
+
+        users[0].name = 'bob'
+        users[1].friends.append(2)
+        users[2].token = Token(secret='a')
+        users[2].token.secret = 'b'
+        # unchanged documents are not written
+        session.register(User(id=5))
+        self.assertEqual(len(session), 4)
+
+        self.assertEqual(session.flush(), [2, 2])
+        self.assertEqual(collection.calls, [
+            ([InsertOne({'id': 1, 'name': 'new', 'friends': []}),
+              UpdateOne({'_id': 2}, {'$set': {'name': 'bob'}})], False),
+            ([UpdateOne({'_id': 3}, {'$push': {'friends': {'$each': [2]}}}),
+              UpdateOne({'_id': 4}, {'$set': {'token': {'secret': 'b'}}})], False)])
+        self.assertEqual(len(session), 0)
+        for user in users:
+            self.assertEqual(user.modified_fields(), set())
+        self.assertEqual(users[1].friends._ops, [])
+        self.assertEqual(users[2].token.modified_fields(), set())
+
+        # changes after the flush, including inserted documents, are tracked
+        new_user.name = 'renamed'
+        users[1].friends.append(3)
+        session.flush()
+        self.assertEqual(collection.calls[-1], (
+            [UpdateOne({'_id': 1}, {'$set': {'name': 'renamed'}}),
+             UpdateOne({'_id': 3}, {'$push': {'friends': {'$each': [3]}}})], False))
+
+        # reaching max_pending flushes the other pending documents
+        collection = FakeCollection()
+        session = dico.mongo.Session(collection, max_pending=2)
+        for user in users:
+            session.register(user)
+            user.name = 'max %d' % user.id
+        self.assertEqual(len(collection.calls), 1)
+        self.assertEqual(collection.calls[0][0], [
+            UpdateOne({'_id': 2}, {'$set': {'name': 'max 2'}}),
+            UpdateOne({'_id': 3}, {'$set': {'name': 'max 3'}})])
+        self.assertTrue(collection.calls[0][1])
+        self.assertEqual(len(session), 1)
+
+        # the oldest change reached max_delay, changes never flush
+        collection = FakeCollection()
+        session = dico.mongo.Session(collection, max_delay=0)
+        session.register(users[0])
+        session.register(users[1])
+        users[0].name = 'delay'
+        users[1].name = 'delay'
+        self.assertEqual(collection.calls, [])
+        self.assertTrue(session.is_due())
+        self.assertEqual(session.flush_due(), [2])
+        self.assertEqual(collection.calls[0][0],
+            [UpdateOne({'_id': 2}, {'$set': {'name': 'delay'}}),
+             UpdateOne({'_id': 3}, {'$set': {'name': 'delay'}})])
+        self.assertFalse(session.is_due())
+        self.assertEqual(session.flush_due(), None)
+
+        # invalid documents raise before anything is written
+        users[0].name = 3
+        self.assertRaises(dico.ValidationException, session.flush)
+        self.assertEqual(len(collection.calls), 1)
+
+        # an invalid pending document does not break changes of other ones
+        session = dico.mongo.Session(collection, max_pending=1)
+        session.register(users[0])
+        session.register(users[1])
+        users[1].name = 'other'
+        self.assertEqual(users[1].name, 'other')
+        self.assertEqual(len(session), 2)
+        session.register(users[2])
+        self.assertEqual(len(collection.calls), 1)
+        self.assertRaises(dico.ValidationException, session.flush)
+        users[0].name = 'valid'
+        session.flush()
+        self.assertEqual(len(collection.calls), 2)
+        self.assertEqual(len(session), 0)
+
+        # a context manager flushes on exit
+        collection = FakeCollection()
+        with dico.mongo.Session(collection) as session:
+            session.add(User(id=6))
+        self.assertEqual(collection.calls, [([InsertOne({'id': 6, 'friends': []})], True)])
+
+    def test_projection(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+            scope = dico.StringField()
+
+            public_fields = ['scope']
+
+        class User(dico.Document):
+            id = dico.mongo.ObjectIdField(aliases=['_id'])
+            firstname = dico.StringField()
+            lastname = dico.StringField()
+            password = dico.StringField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            pre_save_filter = [partial(dico.rename_field, 'id', '_id')]
+            public_fields = ['id', 'fullname', 'token', 'tokens']
+
+            @property
+            @dico.depends_on('firstname', 'lastname')
+            def fullname(self):
+                return '%s %s' % (self.firstname, self.lastname)
+
+        self.assertEqual(dico.mongo.projection(User), {'_id': 1, 'firstname': 1,
+            'lastname': 1, 'token.scope': 1, 'tokens.scope': 1})
+        self.assertEqual(dico.mongo.projection(User, 'save'), {'_id': 1, 'firstname': 1,
+            'lastname': 1, 'password': 1, 'token.secret': 1, 'token.scope': 1,
+            'tokens.secret': 1, 'tokens.scope': 1})
+        # nothing to read only fetches _id, {'_id': 0} would fetch everything
+        self.assertEqual(dico.mongo.projection(Token, 'owner'), {'_id': 1})
+
+        class Post(dico.Document):
+            title = dico.StringField()
+            author = dico.EmbeddedDocumentField(User)
+
+            owner_fields = ['title', 'summary']
+            public_fields = ['title', 'author_name']
+
+            @property
+            def summary(self):
+                return self.title[:10]
+
+            @property
+            @dico.depends_on('author.firstname')
+            def author_name(self):
+                return self.author.firstname
+
+        self.assertEqual(dico.mongo.projection(Post), {'_id': 0, 'title': 1,
+                                                       'author.firstname': 1})
+        # unknown dependencies fetch the whole document
+        self.assertIsNone(dico.mongo.projection(Post, 'owner'))
+
+        # dotted dependencies use the stored names of the embedded class
+        class Tok(dico.Document):
+            secret = dico.StringField(db_name='s')
+            scope = dico.StringField()
+
+            pre_save_filter = [partial(dico.rename_field, 'scope', 'sc')]
+
+        class Account(dico.Document):
+            token = dico.EmbeddedDocumentField(Tok)
+
+            public_fields = ['secret', 'scope']
+
+            @property
+            @dico.depends_on('token.secret')
+            def secret(self):
+                return self.token.secret
+
+            @property
+            @dico.depends_on('token.scope')
+            def scope(self):
+                return self.token.scope
+
+        self.assertEqual(dico.mongo.projection(Account),
+                         {'_id': 0, 'token.s': 1, 'token.sc': 1})
+
+        class Bad(dico.Document):
+            public_fields = ['missing']
+        self.assertRaises(KeyError, dico.mongo.projection, Bad)
+
+    def test_db_name(self):
+        class Token(dico.Document):
+            secret = dico.StringField(db_name='s')
+
+            public_fields = ['secret']
+
+        class User(dico.Document):
+            id = dico.mongo.ObjectIdField(required=True, db_name='_id')
+            name = dico.StringField(db_name='n')
+            token = dico.EmbeddedDocumentField(Token, db_name='t')
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token), db_name='ts')
+
+            public_fields = ['id', 'name', 'token']
+            identity_map = dico.IdentityMap('id')
+
+        user_id = ObjectId()
+        stored = {'_id': user_id, 'n': 'bob', 't': {'s': 'a'}, 'ts': [{'s': 'b'}]}
+        self.assertTrue(User.validate_dict(stored))
+        user = User(**stored)
+        self.assertEqual(user.id, user_id)
+        self.assertEqual(user.tokens[0].secret, 'b')
+        self.assertEqual(user.dict_for_save(), stored)
+        self.assertEqual(bson.BSON(dico.mongo.bson_for_save(user)).decode(), stored)
+        self.assertEqual(user.dict_for_public(),
+                         {'id': user_id, 'name': 'bob', 'token': {'secret': 'a'}})
+        self.assertRaises(ValueError, User, id=user_id, _id=user_id)
+
+        user.name = 'alice'
+        self.assertEqual(user.dict_for_modified_fields(), {'n': 'alice'})
+        user.tokens[0].secret = 'c'
+        user.token.secret = 'd'
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$set': {
+            'n': 'alice', 'ts.0.s': 'c', 't.s': 'd'}})
+        user.commit()
+        user.tokens.append(Token(secret='e'))
+        self.assertEqual(dico.mongo.dict_for_update(user),
+                         {'$push': {'ts': {'$each': [{'s': 'e'}]}}})
+
+        self.assertEqual(dico.mongo.projection(User),
+                         {'_id': 1, 'n': 1, 't.s': 1})
+        self.assertIs(User.load(stored), User.load({'_id': user_id}))
+
+    def test_instrument(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+            pre_save_filter = [lambda data: data]
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            public_fields = ['id']
+
+        original_init = dico.Document.__dict__['__init__']
+        original_prepare = dico.ListField.__dict__['_prepare']
+        self.assertFalse(dico.instrument.installed())
+
+        aggregator = dico.instrument.Aggregator()
+        events = []
+
+        def token_hook(event, document_class, seconds):
+            events.append((event, document_class))
+
+        dico.instrument.add_hook(aggregator)
+        dico.instrument.add_hook(token_hook, classes=[Token])
+        try:
+            self.assertTrue(dico.instrument.installed())
+            user = User(id=1, token={'secret': 'a'}, tokens=[{'secret': 'b'}])
+            self.assertTrue(user.validate())
+            user.dict_for_public()
+            user.token.dict_for_save()
+        finally:
+            dico.instrument.remove_hook(aggregator)
+            self.assertTrue(dico.instrument.installed())
+            dico.instrument.remove_hook(token_hook)
+
+        snapshot = aggregator.snapshot()
+        self.assertEqual(snapshot['User']['construct']['count'], 1)
+        # token, tokens and the entry of tokens
+        self.assertEqual(snapshot['User']['prepare']['count'], 3)
+        self.assertEqual(snapshot['User']['validate']['count'], 1)
+        self.assertEqual(snapshot['User']['dict_for_public']['count'], 1)
+        self.assertEqual(snapshot['Token']['construct']['count'], 2)
+        # through user.validate() twice then dict_for_save
+        self.assertEqual(snapshot['Token']['validate']['count'], 3)
+        self.assertEqual(snapshot['Token']['filters']['count'], 1)
+        self.assertTrue(snapshot['User']['construct']['total'] >=
+                        snapshot['User']['prepare']['max'])
+        self.assertEqual(set(event[1] for event in events), set([Token]))
+        self.assertIn(('filters', Token), events)
+
+        # without hooks the original methods are back
+        self.assertFalse(dico.instrument.installed())
+        self.assertIs(dico.Document.__dict__['__init__'], original_init)
+        self.assertIs(dico.ListField.__dict__['_prepare'], original_prepare)
+        self.assertRaises(ValueError, dico.instrument.remove_hook, aggregator)
+        User(id=2)
+        self.assertEqual(aggregator.snapshot()['User']['construct']['count'], 1)
+        aggregator.reset()
+        self.assertEqual(aggregator.snapshot(), {})
+
+    def test_clone(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            name = dico.StringField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+            friends = dico.ListField(dico.IntegerField())
+
+        template = User(id=1, token={'secret': 'a'}, tokens=[{'secret': 'b'}],
+                        friends=[1, 2])
+        template.name = 'template'
+        saved = template.dict_for_save()
+
+        user = template.clone()
+        self.assertEqual(user.modified_fields(), set())
+        self.assertEqual(user.modified_paths(), set())
+        self.assertEqual(user.dict_for_save(), saved)
+        # subtrees are shared until accessed
+        self.assertIs(User._readers['token'](user), User._readers['token'](template))
+        self.assertIs(User._readers['tokens'](user), User._readers['tokens'](template))
+
+        user.token.secret = 'z'
+        user.tokens[0].secret = 'y'
+        user.friends.append(3)
+        self.assertEqual(user.modified_paths(), set(['token.secret', 'tokens.0.secret', 'friends']))
+        self.assertEqual(user.friends._ops, [('push', [3])])
+        self.assertIs(user.token._parent, user)
+        self.assertIs(user.tokens._parent, user)
+        self.assertIs(user.tokens[0]._parent, user)
+        self.assertEqual(template.dict_for_save(), saved)
+        self.assertEqual(template.modified_paths(), set(['name']))
+
+        # the last owner takes the subtree itself
+        token = User._readers['token'](template)
+        self.assertIs(template.token, token)
+        self.assertIs(token._parent, template)
+        template.token.secret = 'x'
+        self.assertEqual(user.token.secret, 'z')
+
+        # clones of clones and replaced values
+        first = template.clone()
+        second = first.clone()
+        first.token = Token(secret='first')
+        second.tokens.append(Token(secret='second'))
+        self.assertEqual(template.token.secret, 'x')
+        self.assertEqual(len(template.tokens), 1)
+        self.assertEqual(len(first.tokens), 1)
+        self.assertEqual(second.token.secret, 'x')
+        self.assertIsNot(second.token, template.token)
+        self.assertEqual(second.modified_fields(), set(['tokens']))
+
+        # writes through references taken before clone() stay in the source
+        class Inner(dico.Document):
+            value = dico.IntegerField()
+
+        class Wrapper(dico.Document):
+            inner = dico.EmbeddedDocumentField(Inner)
+
+        class Vault(dico.Document):
+            token = dico.EmbeddedDocumentField(Token)
+            tags = dico.ListField(dico.StringField())
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+            wrapper = dico.EmbeddedDocumentField(Wrapper)
+
+        vault = Vault(token={'secret': 'a'}, tags=['a'], tokens=[{'secret': 'b'}],
+                      wrapper={'inner': {'value': 1}})
+        vault.commit()
+        token, tags, first = vault.token, vault.tags, vault.tokens[0]
+        inner = vault.wrapper.inner
+        cloned = vault.clone()
+        token.secret = 'changed'
+        tags.append('b')
+        first.secret = 'changed'
+        inner.value = 2
+        self.assertEqual(cloned.dict_for_save(),
+            {'token': {'secret': 'a'}, 'tags': ['a'], 'tokens': [{'secret': 'b'}],
+             'wrapper': {'inner': {'value': 1}}})
+        self.assertEqual(vault.dict_for_save(),
+            {'token': {'secret': 'changed'}, 'tags': ['a', 'b'],
+             'tokens': [{'secret': 'changed'}], 'wrapper': {'inner': {'value': 2}}})
+        self.assertIs(vault.token, token)
+        self.assertEqual(vault.modified_paths(), set(['token.secret', 'tags',
+            'tokens.0.secret', 'wrapper.inner.value']))
+        self.assertEqual(vault.tags._ops, [('push', ['b'])])
+        self.assertEqual(cloned.modified_paths(), set())
+        self.assertEqual(cloned.tags._ops, [])
+        cloned.token.secret = 'clone'
+        self.assertEqual(token.secret, 'changed')
+        self.assertEqual(cloned.modified_paths(), set(['token.secret']))
+        # taking a copy leaves the source tracking alone
+        again = vault.clone()
+        again.tags.append('c')
+        again.tokens[0].secret = 'again'
+        self.assertEqual(vault.tags._ops, [('push', ['b'])])
+        self.assertIn('tokens.0.secret', vault.modified_paths())
+        self.assertEqual(vault.tags, ['a', 'b'])
+
+        # deepcopy keeps working lists
+        copied = copy.deepcopy(template)
+        self.assertIsInstance(copied.friends, dico.NotifyParentList)
+        copied.friends.append(4)
+        copied.tokens[0].secret = 'w'
+        self.assertIn('tokens.0.secret', copied.modified_paths())
+        self.assertEqual(template.friends, [1, 2])
+        self.assertEqual(template.tokens[0].secret, 'b')
+
+    def test_iter_from(self):
+        class User(dico.Document):
+            id = dico.IntegerField(required=True, aliases=['_id'])
+            name = dico.StringField()
+
+            public_fields = ['name']
+
+        class FakeCursor(object):
+            def __init__(self, records):
+                self.records = records
+                self.size = None
+
+            def batch_size(self, size):
+                self.size = size
+                return self
+
+            def __iter__(self):
+                return iter(self.records)
+
+        records = [{'_id': i, 'name': 'user%d' % i} for i in range(10)]
+        records[3] = {'name': 'no id'}
+        records[7] = {'id': 7, '_id': 7}
+
+        users = list(User.iter_from(records, chunk_size=3))
+        self.assertEqual(len(users), 9)
+        self.assertIsInstance(users[0], User)
+
+        errors = []
+        users = User.iter_from(records, validate=True, chunk_size=4,
+            on_error=lambda data, exception: errors.append(data))
+        self.assertEqual([user.id for user in users], [0, 1, 2, 4, 5, 6, 8, 9])
+        self.assertEqual(errors, [records[3], records[7]])
+
+        errors = []
+        users = User.iter_from(records, validate='partial', visibility='public',
+            on_error=lambda data, exception: errors.append(data))
+        self.assertEqual(len(list(users)), 9)
+        self.assertEqual(errors, [records[7]])
+
+        cursor = FakeCursor(records)
+        users = dico.mongo.iter_cursor(User, cursor, chunk_size=5, visibility='public')
+        self.assertEqual(next(users), {'name': 'user0'})
+        self.assertEqual(cursor.size, 5)
+
+    def test_incremental_validation(self):
+        checked = []
+
+        class CountedField(dico.IntegerField):
+            def _validate(self, value):
+                checked.append(self.field_name)
+                return isinstance(value, int)
+
+        class Token(dico.Document):
+            count = CountedField()
+            other = CountedField()
+
+        class User(dico.Document):
+            id = CountedField(required=True)
+            age = CountedField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+        user = User(id=1, age=2, token={'count': 3, 'other': 4}, tokens=[{'count': 5}])
+        self.assertTrue(user.validate())
+        self.assertEqual(len(checked), 5)
+
+        del checked[:]
+        self.assertTrue(user.validate())
+        self.assertEqual(checked, [])
+
+        user.age = 3
+        self.assertTrue(user.validate())
+        self.assertEqual(checked, ['age'])
+
+        # only the modified field of the embedded document is checked again
+        del checked[:]
+        user.token.count = 'a'
+        self.assertFalse(user.validate())
+        self.assertEqual(checked, ['count'])
+        user.token.count = 4
+        self.assertTrue(user.validate())
+
+        del checked[:]
+        user.tokens[0].count = 6
+        self.assertTrue(user.validate())
+        self.assertEqual(checked, ['count'])
+
+        # an embedded document set as an object notifies its new parent
+        user.token = Token(count=1)
+        self.assertTrue(user.validate())
+        user.token.other = 'b'
+        self.assertFalse(user.validate())
+
+        # a missing required field is not cached by validate_partial
+        user = User()
+        self.assertTrue(user.validate_partial())
+        self.assertFalse(user.validate())
+
+    def test_modified_paths(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+            active = dico.BooleanField(default=True)
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            name = dico.StringField()
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+        class Group(dico.Document):
+            user = dico.EmbeddedDocumentField(User)
+
+        user = User(id=1, token={'secret': 'a'},
+                    tokens=[{'secret': 'b'}, {'secret': 'c'}])
+        user.token.active = False
+        user.tokens[1].secret = 'd'
+        self.assertEqual(user.modified_paths(), set(['token.active', 'tokens.1.secret']))
+        self.assertEqual(user.modified_fields(), set(['token', 'tokens']))
+        self.assertEqual(dico.mongo.dict_for_update(user),
+            {'$set': {'token.active': False, 'tokens.1.secret': 'd'}})
+
+        # a parent path covers its children
+        user.token = Token(secret='e')
+        user.token.secret = 'f'
+        user.name = None
+        self.assertEqual(dico.mongo.dict_for_update(user),
+            {'$set': {'token': {'secret': 'f', 'active': True}, 'tokens.1.secret': 'd'},
+             '$unset': {'name': ''}})
+
+        group = Group(user={'id': 1, 'tokens': [{'secret': 'a'}]})
+        group.user.tokens[0].active = False
+        self.assertEqual(group.modified_paths(), set(['user.tokens.0.active']))
+
+        # indexes are looked up when the paths are read
+        group.user.tokens.insert(0, {'secret': 'z'})
+        group.commit()
+        token = group.user.tokens[1]
+        token.secret = 'y'
+        self.assertEqual(group.modified_paths(), set(['user.tokens.1.secret']))
+        # a token no longer in the list marks the whole list
+        group.commit()
+        group.user.tokens.pop()
+        group.commit()
+        token.secret = 'x'
+        self.assertEqual(group.modified_paths(), set(['user.tokens']))
+
+        user = User(id=1)
+        user.name = 3
+        self.assertRaises(dico.ValidationException, dico.mongo.dict_for_update, user)
+
+    def test_list_operations_update(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+        class User(dico.Document):
+            id = dico.IntegerField()
+            friends = dico.ListField(dico.IntegerField())
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+        user = User(id=1, friends=[1, 2, 3], tokens=[{'secret': 'a'}])
+        user.friends.append(4)
+        user.friends.extend(x for x in [5, 6])
+        user.tokens.append(Token(secret='b'))
+        self.assertEqual(user.friends, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$push': {
+            'friends': {'$each': [4, 5, 6]},
+            'tokens': {'$each': [{'secret': 'b'}]}}})
+
+        user = User(id=1, friends=[1, 2, 3])
+        self.assertEqual(user.friends.pop(), 3)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$pop': {'friends': 1}})
+
+        user = User(id=1, friends=[1, 2, 3])
+        self.assertEqual(user.friends.pop(0), 1)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$pop': {'friends': -1}})
+
+        user = User(id=1, friends=[1, 2, 3])
+        user.friends.remove(2)
+        user.friends.remove(3)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$pullAll': {'friends': [2, 3]}})
+
+        # + returns a new list and leaves the logged operations alone
+        user = User(id=1, friends=[1])
+        user.friends.append(2)
+        self.assertEqual(user.friends + [5], [1, 2, 5])
+        self.assertEqual(user.friends, [1, 2])
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$push': {'friends': {'$each': [2]}}})
+
+        # mixed or unsafe operations fall back to a full $set
+        user = User(id=1, friends=[1, 2, 2])
+        user.friends.remove(2)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$set': {'friends': [1, 2]}})
+
+        user = User(id=1, friends=[1, 2, 3])
+        user.friends.append(4)
+        user.friends.pop(0)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$set': {'friends': [2, 3, 4]}})
+
+        user = User(id=1, friends=[3, 1])
+        user.friends.sort()
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$set': {'friends': [1, 3]}})
+
+        user = User(id=1, tokens=[{'secret': 'a'}])
+        user.tokens.append(Token(secret='b'))
+        user.tokens[0].secret = 'c'
+        self.assertEqual(dico.mongo.dict_for_update(user),
+            {'$set': {'tokens': [{'secret': 'c'}, {'secret': 'b'}]}})
+
+        user = User(id=1)
+        user.friends = [1]
+        user.friends.append(2)
+        self.assertEqual(dico.mongo.dict_for_update(user), {'$set': {'friends': [1, 2]}})
+
+    def test_json_compliant(self):
+        class Token(dico.Document):
+            id = dico.mongo.ObjectIdField()
+            created = dico.DateTimeField()
+
+            public_fields = ['id', 'created']
+
+        class User(dico.Document):
+            id = dico.mongo.ObjectIdField()
+            name = dico.StringField()
+            score = dico.FloatField()
+            active = dico.BooleanField()
+            dates = dico.ListField(dico.DateTimeField())
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            @property
+            def label(self):
+                return u'caf\xe9 %s' % self.name
+
+            public_fields = ['id', 'name', 'score', 'active', 'dates', 'tokens', 'label']
+
+        date = datetime.datetime(2012, 7, 17, 10, 30)
+        object_id = ObjectId('500535541aebce0dfc000000')
+        user = User(id=object_id, name='Bob', score=1.5, active=True, dates=[date],
+                    tokens=[{'id': object_id, 'created': date}])
+
+        expected = {'id': '500535541aebce0dfc000000', 'name': 'Bob', 'score': 1.5,
+            'active': True, 'dates': ['2012-07-17T10:30:00'], 'label': u'caf\xe9 Bob',
+            'tokens': [{'id': '500535541aebce0dfc000000', 'created': '2012-07-17T10:30:00'}]}
+        self.assertEqual(user.dict_for_public(json_compliant=True), expected)
+        self.assertEqual(user.dict_for_public()['id'], object_id)
+        self.assertEqual(user.dict_for_save(json_compliant=True)['dates'],
+                         ['2012-07-17T10:30:00'])
+
+        self.assertEqual(json.loads(dico.dumps(user)), expected)
+        self.assertEqual(json.loads(dico.dumps([user, user])), [expected, expected])
+        output = StringIO.StringIO()
+        dico.dump(user, output, visibility='save')
+        self.assertEqual(json.loads(output.getvalue())['tokens'][0]['created'],
+                         '2012-07-17T10:30:00')
+
+        class Filtered(dico.Document):
+            id = dico.IntegerField()
+            public_fields = ['id']
+            pre_public_filter = [partial(dico.rename_field, 'id', '_id')]
+
+        self.assertEqual(dico.dumps(Filtered(id=3)), '{"_id":3}')
+
+        user.name = 3
+        self.assertRaises(dico.ValidationException, dico.dumps, user)
+
+    def test_bson_for_save(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+            created = dico.DateTimeField()
+
+        class User(dico.Document):
+            id = dico.mongo.ObjectIdField(aliases=['_id'], default=ObjectId)
+            name = dico.StringField()
+            count = dico.IntegerField()
+            big = dico.IntegerField()
+            score = dico.FloatField()
+            active = dico.BooleanField()
+            friends = dico.ListField(dico.IntegerField())
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+            pre_save_filter = [partial(dico.rename_field, 'id', '_id')]
+
+        date = datetime.datetime(2012, 7, 17, 10, 30, 15, 123000)
+        user = User(name=u'caf\xe9', count=3, big=2 ** 40, score=1.5, active=False,
+                    friends=[1, 2], token={'secret': 'a', 'created': date},
+                    tokens=[{'secret': 'b'}, {'secret': 'c'}])
+
+        raw = dico.mongo.bson_for_save(user)
+        self.assertEqual(bson.BSON(raw).decode(), user.dict_for_save())
+        self.assertEqual(len(raw), len(bson.BSON.encode(user.dict_for_save())))
+
+        raw_documents = dico.mongo.bson_for_insert([user, User(name='Bob')])
+        self.assertEqual(raw_documents[1]['name'], 'Bob')
+        self.assertIn('_id', raw_documents[1])
+
+        # other filters fall back on dict_for_save
+        class Filtered(dico.Document):
+            id = dico.IntegerField()
+
+            def add_name(filter_dict):
+                filter_dict['name'] = 'Paule'
+                return filter_dict
+
+            pre_save_filter = [add_name]
+
+        self.assertEqual(bson.BSON(dico.mongo.bson_for_save(Filtered(id=1))).decode(),
+                         {'id': 1, 'name': 'Paule'})
+
+        # like pymongo, integers out of the int64 range raise OverflowError
+        user.big = 2 ** 63
+        self.assertRaises(OverflowError, bson.BSON.encode, user.dict_for_save())
+        self.assertRaises(OverflowError, dico.mongo.bson_for_save, user)
+        user.big = -2 ** 63
+        self.assertEqual(bson.BSON(dico.mongo.bson_for_save(user)).decode()['big'], -2 ** 63)
+
+        user.count = 'a'
+        self.assertRaises(dico.ValidationException, dico.mongo.bson_for_save, user)
+
+    def test_validation_errors(self):
+        class Token(dico.Document):
+            secret = dico.StringField(required=True, max_length=4)
+            kind = dico.StringField(choices=['a', 'b'])
+
+        class User(dico.Document):
+            id = dico.IntegerField(required=True)
+            name = dico.StringField(max_length=8)
+            friends = dico.ListField(dico.IntegerField(), max_length=3)
+            token = dico.EmbeddedDocumentField(Token)
+            tokens = dico.ListField(dico.EmbeddedDocumentField(Token))
+
+        user = User(name='Bob', friends=[1, 2], token={'secret': 'abc'},
+                    tokens=[{'secret': 'abc'}])
+        self.assertEqual(user.validation_errors(), [('id', 'required')])
+        self.assertEqual(user.validation_errors(stop_on_required=False), [])
+
+        user = User(id=1, name=3, friends=[1, 'a', 'b'], token={'kind': 'c'},
+                    tokens=[{'secret': 'abc'}, {'secret': 'abcdef'}, 3])
+        self.assertEqual(sorted(user.validation_errors()), [
+            ('friends.1', 'invalid'), ('friends.2', 'invalid'), ('name', 'invalid'),
+            ('token.kind', 'choices'), ('token.secret', 'required'),
+            ('tokens.1.secret', 'invalid'), ('tokens.2', 'invalid')])
+        self.assertFalse(user.validate())
+
+        self.assertEqual(len(user.validation_errors(max_errors=3)), 3)
+        self.assertEqual(len(user.validation_errors(fail_fast=True)), 1)
+
+        user.friends = range(10)
+        self.assertIn(('friends', 'invalid'), user.validation_errors())
+
+        # a large invalid payload stops at the cap
+        user = User(id=1, tokens=[{'secret': 'too long'}] * 1000)
+        self.assertEqual(len(user.validation_errors(max_errors=10)), 10)
+
+        user = User(id=1)
+        self.assertEqual(user.validation_errors(), [])
+        self.assertTrue(user.validate())
+
+        # embedded documents are checked for required fields, like validate_partial
+        for data in [{'token': {}}, {'tokens': [{}]}]:
+            user = User(**data)
+            errors = user.validation_errors(stop_on_required=False)
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(errors[0][1], 'required')
+            self.assertFalse(user.validate_partial())
+            self.assertFalse(user.validate())
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_document_batch(self):
+        class Token(dico.Document):
+            secret = dico.StringField()
+
+        class Event(dico.Document):
+            id = dico.IntegerField(required=True, aliases=['_id'])
+            score = dico.FloatField()
+            active = dico.BooleanField(default=True)
+            kind = dico.IntegerField(choices=[1, 2])
+            date = dico.DateTimeField()
+            name = dico.StringField(max_length=4)
+            token = dico.EmbeddedDocumentField(Token)
+
+        date = datetime.datetime(2012, 7, 17, 10, 30, 0, 1000)
+        records = [
+            {'_id': 1, 'score': 1.5, 'kind': 1, 'date': date, 'name': 'Bob'},
+            {'id': 2, 'score': 2, 'active': False, 'token': {'secret': 'a'}},
+            {'score': 1.0},
+            {'id': 'a'},
+            {'id': 5, 'kind': 3},
+            {'id': 2 ** 70, 'name': 'too long'},
+            {'id': 7, 'token': {'secret': 3}},
+        ]
+        batch = dico.batch.DocumentBatch.from_dicts(Event, records)
+        self.assertEqual(len(batch), 7)
+        self.assertEqual(batch.column('id').dtype, numpy.int64)
+        self.assertEqual(batch.column('score').dtype, numpy.float64)
+
+        expected = [Event.validate_dict(record) for record in records]
+        self.assertEqual(batch.validate().tolist(), expected)
+        self.assertEqual(batch.validate().tolist(),
+                         [True, True, False, False, False, False, False])
+        self.assertEqual(batch.validate_partial().tolist(),
+                         [Event.validate_dict(record, stop_on_required=False)
+                          for record in records])
+
+        dicts = batch.to_dicts()
+        self.assertEqual(dicts[0], {'id': 1, 'score': 1.5, 'active': True, 'kind': 1,
+                                    'date': date, 'name': 'Bob'})
+        self.assertEqual(dicts[2], {'score': 1.0, 'active': True})
+        self.assertEqual(dicts[3]['id'], 'a')
+        self.assertEqual(dicts[5]['id'], 2 ** 70)
+
+        documents = batch.to_documents()
+        self.assertEqual([document.validate() for document in documents], expected)
+        self.assertIsInstance(documents[1].token, Token)
+
+        batch = dico.batch.DocumentBatch.from_documents(Event, documents[:2])
+        self.assertEqual(batch.to_dicts()[1]['token'].secret, 'a')
+        self.assertTrue(batch.validate().all())
+
+        # values come back with their type
+        records = [{'id': 3, 'score': 3, 'active': True}, {'id': 4L, 'active': 1}]
+        dicts = dico.batch.DocumentBatch.from_dicts(Event, records).to_dicts()
+        self.assertEqual(dicts, records)
+        for record, data in zip(records, dicts):
+            for name, value in record.items():
+                self.assertIs(type(data[name]), type(value))
+
     def test_inside_code(self):
         class User(dico.Document):
             id = dico.IntegerField()
@@ -677,8 +1952,9 @@ class TestDico(unittest.TestCase):
         self.assertIn('tokens', user.modified_fields())
 
         user = User(**user_dict)
+        # + returns a new list, the document is not modified
         user.tokens + [token]
-        self.assertIn('tokens', user.modified_fields())
+        self.assertNotIn('tokens', user.modified_fields())
 
         user = User(**user_dict)
         # not that we will add the same object should not raise modification